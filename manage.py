@@ -1,23 +1,32 @@
 # manage.py
 import os
+import sys
+import time
 import unittest
-import coverage
 
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
-COV = coverage.coverage(
-    branch=True,
-    include='project/*',
-    omit=[
-        'project/tests/*',
-        'project/server/config.py',
-        'project/server/*/__init__.py'
-    ]
-)
-COV.start()
-
-from project.server import app, db, models
+# Coverage is only measured for "manage.py cov"; it has to start before the project
+# modules are imported, but every other command should boot without its overhead
+COV = None
+if sys.argv[1:2] == ['cov']:
+    import coverage
+    COV = coverage.coverage(
+        branch=True,
+        include='project/*',
+        omit=[
+            'project/tests/*',
+            'project/benchmarks/*',
+            'project/server/config.py',
+            'project/server/*/__init__.py'
+        ]
+    )
+    COV.start()
+
+from project.server import create_app, db, models
+from project.server import sweeper
+app = create_app()
 migrate = Migrate(app, db)
 manager = Manager(app)
 
@@ -28,8 +37,10 @@ manager.add_command('db', MigrateCommand)
 @manager.command
 def test():
     """Runs the unit tests without test coverage."""
+    start = time.time()
     tests = unittest.TestLoader().discover('project/tests', pattern='test*.py')
     result = unittest.TextTestRunner(verbosity=2).run(tests)
+    print('Wall-clock time: {:.2f}s'.format(time.time() - start))
     if result.wasSuccessful():
         return 0
     return 1
@@ -38,9 +49,11 @@ def test():
 @manager.command
 def cov():
     """Runs the unit tests with coverage."""
+    start = time.time()
     tests = unittest.TestLoader().discover('project/tests')
     result = unittest.TextTestRunner(verbosity=2).run(tests)
-    if result.wasSuccessful():
+    print('Wall-clock time: {:.2f}s'.format(time.time() - start))
+    if result.wasSuccessful() and COV is not None:
         COV.stop()
         COV.save()
         print('Coverage Summary:')
@@ -66,5 +79,119 @@ def drop_db():
     db.drop_all()
 
 
+@manager.command
+def rebuild_bloom():
+    """Rebuilds the blacklist bloom filter and reports its size."""
+    bloom = models.BlacklistToken.rebuild_bloom()
+    print('Tokens: {}'.format(len(bloom)))
+    print('Bits: {} ({} hash functions)'.format(bloom.num_bits, bloom.num_hashes))
+    print('Fill ratio: {:.4f}'.format(bloom.fill_ratio()))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=None)
+def prune_blacklist(batch_size=None):
+    """Deletes expired blacklist tokens in batches."""
+    removed, elapsed = sweeper.prune_blacklist(batch_size)
+    print('Removed {} expired tokens in {:.3f}s'.format(removed, elapsed))
+
+
+@manager.option('path')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=None)
+def import_users(path, batch_size=None):
+    """Imports users from a CSV or JSON-lines file."""
+    from project.server import importer
+
+    def progress(stats):
+        print('Imported {} users, {} duplicates, {} invalid ({:.1f} users/s)'.format(
+            stats['imported'], len(stats['duplicates']), stats['invalid'],
+            stats['imported'] / max(stats['elapsed'], 1e-6)))
+
+    fmt = 'csv' if path.endswith('.csv') else 'jsonl'
+    with open(path) as f:
+        stats = importer.import_users(importer.read_records(f, fmt), batch_size, progress)
+    for email in stats['duplicates']:
+        print('Skipped duplicate: {}'.format(email))
+    print('Done in {:.1f}s'.format(stats['elapsed']))
+
+
+@manager.option('-a', '--algorithm', dest='algorithm', default=None)
+@manager.option('-k', '--keep', dest='keep', type=int, default=3)
+def rotate_keys(algorithm=None, keep=3):
+    """Generates a new signing key and keeps only the newest `keep` keys."""
+    from project.server import signing
+    key_dir = app.config.get('JWT_KEY_DIR')
+    algorithm = algorithm or app.config.get('JWT_ALGORITHM')
+    if algorithm not in signing.ASYMMETRIC_ALGORITHMS:
+        algorithm = 'RS256'
+    kid = signing.generate_key(key_dir, algorithm)
+    print('New {} signing key: {}'.format(algorithm, kid))
+    print('Published on /auth/jwks now; signs tokens after {} seconds'.format(
+        app.config.get('JWT_KEY_ACTIVATION_DELAY')))
+    kids = sorted(name[:-4] for name in os.listdir(key_dir) if name.endswith('.pem'))
+    # the previous key keeps signing until the new one activates, so it is never removed here
+    for old_kid in kids[:-max(keep, 2)]:
+        os.remove(os.path.join(key_dir, old_kid + '.pem'))
+        print('Removed key: {}'.format(old_kid))
+
+
+@manager.option('-b', '--budget', dest='budget', type=float, default=250)
+def calibrate_bcrypt(budget=250):
+    """Picks the largest bcrypt cost that hashes within the budget (ms)."""
+    from project.server.hashing import calibrate
+    rounds, timings = calibrate(budget)
+    for cost, elapsed_ms in timings:
+        print('cost {:>2}: {:8.1f} ms'.format(cost, elapsed_ms))
+    print('Recommended: export BCRYPT_LOG_ROUNDS={}'.format(rounds))
+
+
+@manager.option('-c', '--clients', dest='clients', type=int, default=8)
+@manager.option('-d', '--duration', dest='duration', type=float, default=10)
+@manager.option('-s', '--status', dest='status_per_cycle', type=int, default=5)
+@manager.option('-r', '--rounds', dest='rounds', type=int, default=4)
+@manager.option('-o', '--output', dest='output', default=None)
+def bench(clients=8, duration=10, status_per_cycle=5, rounds=4, output=None):
+    """Benchmarks register, login, status and logout against SQLite."""
+    from project.benchmarks import endpoints
+    results = endpoints.run(clients, duration, status_per_cycle, rounds)
+    print(endpoints.format_results(results))
+    if output is None:
+        basedir = os.path.abspath(os.path.dirname(__file__))
+        output = os.path.join(basedir, 'tmp/bench', 'bench-{}.json'.format(results['commit'] or 'local'))
+    endpoints.write_results(results, output)
+    print('Results written to {}'.format(output))
+
+
+@manager.option('-c', '--clients', dest='clients', type=int, default=16)
+@manager.option('-d', '--duration', dest='duration', type=float, default=5)
+@manager.option('-r', '--rounds', dest='rounds', type=int, default=12)
+def bench_hashing(clients=16, duration=5, rounds=12):
+    """Benchmarks mixed login/status traffic with and without the hashing pool."""
+    from project.benchmarks import hashing
+    results = hashing.run(clients=clients, duration=duration, rounds=rounds)
+    for mode in ('inline', 'pool'):
+        print('{:<8} login {:8.1f}/s  status {:8.1f}/s  shed {:8.1f}/s'.format(
+            mode, results[mode]['login'], results[mode]['status'], results[mode]['shed']))
+
+
+@manager.option('-n', '--iterations', dest='iterations', type=int, default=20000)
+def bench_tokens(iterations=20000):
+    """Compares HS256 tokens per second through PyJWT and HS256Engine."""
+    from project.benchmarks import tokens
+    results = tokens.run(iterations)
+    for engine in ('pyjwt', 'engine'):
+        print('{:<8} encode {:10.0f}/s  decode {:10.0f}/s'.format(
+            engine, results[engine]['encode'], results[engine]['decode']))
+
+
+@manager.option('-n', '--runs', dest='runs', type=int, default=5)
+def bench_startup(runs=5):
+    """Measures the time from a cold import to the first served request."""
+    from project.benchmarks import startup
+    results = startup.run(runs)
+    for name in ('import', 'create_app', 'first_request', 'total'):
+        print('{:<14} median {:8.1f} ms  max {:8.1f} ms'.format(
+            name, results[name]['median_ms'], results[name]['max_ms']))
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,41 @@
+"""key blacklist_tokens by jti
+
+Revision ID: 3f9a7c2d6e10
+Revises: 8b1d0c5e2f41
+Create Date: 2026-10-18 09:31:05.402871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a7c2d6e10'
+down_revision = '8b1d0c5e2f41'
+branch_labels = None
+depends_on = None
+
+
+# Existing rows hold raw tokens without a jti or expiry. Access tokens only live
+# for seconds, so they are dropped rather than converted.
+def upgrade():
+    op.drop_table('blacklist_tokens')
+    op.create_table('blacklist_tokens',
+    sa.Column('jti', sa.String(length=64), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('blacklisted_on', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('jti')
+    )
+    op.create_index(op.f('ix_blacklist_tokens_expires_at'), 'blacklist_tokens', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_blacklist_tokens_expires_at'), table_name='blacklist_tokens')
+    op.drop_table('blacklist_tokens')
+    op.create_table('blacklist_tokens',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('token', sa.String(length=500), nullable=False),
+    sa.Column('blacklisted_on', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('token')
+    )
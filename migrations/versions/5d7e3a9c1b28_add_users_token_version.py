@@ -0,0 +1,24 @@
+"""add users.token_version
+
+Revision ID: 5d7e3a9c1b28
+Revises: c42e8d1b7a93
+Create Date: 2026-10-18 14:26:08.113527
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d7e3a9c1b28'
+down_revision = 'c42e8d1b7a93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'token_version')
@@ -0,0 +1,17 @@
+# project/benchmarks/__init__.py
+import os
+import tempfile
+
+from project.server import db
+
+
+# Points the app at a throwaway SQLite database so benchmarks need no external services
+def use_sqlite(app, path=None):
+    if path is None:
+        handle, path = tempfile.mkstemp(prefix='flask_jwt_auth_bench_', suffix='.db')
+        os.close(handle)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return path
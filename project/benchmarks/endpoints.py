@@ -0,0 +1,120 @@
+# project/benchmarks/endpoints.py
+import datetime
+import json
+import math
+import os
+import subprocess
+import threading
+import time
+
+from project.benchmarks import use_sqlite
+from project.server import create_app
+
+ENDPOINTS = ('register', 'login', 'status', 'logout')
+
+
+# Nearest-rank percentile of an already sorted list
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = int(math.ceil(pct / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, min(index, len(sorted_values) - 1))]
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# One simulated client: register, login, `status_per_cycle` status checks, logout
+def _client(app, index, deadline, status_per_cycle, latencies, errors, lock):
+    test_client = app.test_client()
+    cycle = 0
+
+    def timed(endpoint, method, url, **kwargs):
+        start = time.time()
+        response = method(url, **kwargs)
+        elapsed = time.time() - start
+        with lock:
+            latencies[endpoint].append(elapsed)
+            if response.status_code >= 300:
+                errors[endpoint] += 1
+        return response
+
+    while time.time() < deadline:
+        cycle += 1
+        credentials = json.dumps(dict(email='bench-{}-{}@example.com'.format(index, cycle), password='benchmark'))
+        timed('register', test_client.post, '/auth/register', data=credentials, content_type='application/json')
+        response = timed('login', test_client.post, '/auth/login', data=credentials, content_type='application/json')
+        if response.status_code != 200:
+            continue
+        headers = dict(Authorization='Bearer ' + json.loads(response.data.decode())['auth_token'])
+        for _ in range(status_per_cycle):
+            timed('status', test_client.get, '/auth/status', headers=headers)
+        timed('logout', test_client.post, '/auth/logout', headers=headers)
+
+
+# Drives every auth endpoint from `clients` threads for `duration` seconds against a
+# throwaway SQLite database and returns latency percentiles and throughput
+def run(clients=8, duration=10, status_per_cycle=5, rounds=4):
+    app = create_app()
+    use_sqlite(app)
+    app.config['BCRYPT_LOG_ROUNDS'] = rounds
+    # every simulated client shares one address, so login throttling is off
+    app.config['LOGIN_RATE_LIMIT_ENABLED'] = False
+    latencies = dict((endpoint, []) for endpoint in ENDPOINTS)
+    errors = dict((endpoint, 0) for endpoint in ENDPOINTS)
+    lock = threading.Lock()
+    start = time.time()
+    threads = [
+        threading.Thread(target=_client, args=(app, i, start + duration, status_per_cycle, latencies, errors, lock))
+        for i in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    results = {
+        'commit': _git_commit(),
+        'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+        'clients': clients,
+        'duration': elapsed,
+        'status_per_cycle': status_per_cycle,
+        'bcrypt_rounds': rounds,
+        'endpoints': {}
+    }
+    for endpoint in ENDPOINTS:
+        values = sorted(latencies[endpoint])
+        results['endpoints'][endpoint] = {
+            'requests': len(values),
+            'errors': errors[endpoint],
+            'rps': len(values) / elapsed,
+            'p50_ms': percentile(values, 50) * 1000,
+            'p95_ms': percentile(values, 95) * 1000,
+            'p99_ms': percentile(values, 99) * 1000
+        }
+    return results
+
+
+def write_results(results, path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def format_results(results):
+    lines = ['{:<10} {:>9} {:>7} {:>10} {:>10} {:>10} {:>10}'.format(
+        'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms')]
+    for endpoint in ENDPOINTS:
+        stats = results['endpoints'][endpoint]
+        lines.append('{:<10} {:>9} {:>7} {:>10.1f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            endpoint, stats['requests'], stats['errors'], stats['rps'],
+            stats['p50_ms'], stats['p95_ms'], stats['p99_ms']))
+    return '\n'.join(lines)
@@ -0,0 +1,72 @@
+# project/benchmarks/hashing.py
+import json
+import threading
+import time
+
+from project.benchmarks import use_sqlite
+from project.server import create_app
+
+EMAIL = 'bench@example.com'
+PASSWORD = 'benchmark'
+
+
+def _login(test_client):
+    return test_client.post(
+        '/auth/login',
+        data=json.dumps(dict(email=EMAIL, password=PASSWORD)),
+        content_type='application/json'
+    )
+
+
+# Runs mixed login/status traffic for `duration` seconds and returns requests/sec by kind.
+# Each client uses the token from its own latest login for its status checks.
+def _run_mixed(app, clients, duration, status_per_login):
+    counts = {'login': 0, 'status': 0, 'shed': 0}
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client():
+        test_client = app.test_client()
+        auth_token = None
+        n = 0
+        while time.time() < deadline:
+            if auth_token is None or n % (status_per_login + 1) == 0:
+                response = _login(test_client)
+                if response.status_code == 200:
+                    auth_token = json.loads(response.data.decode())['auth_token']
+                    kind = 'login'
+                else:
+                    kind = 'shed'
+            else:
+                test_client.get('/auth/status', headers=dict(Authorization='Bearer ' + auth_token))
+                kind = 'status'
+            n += 1
+            with lock:
+                counts[kind] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return dict((kind, count / float(duration)) for kind, count in counts.items())
+
+
+# Compares throughput of mixed traffic with bcrypt inline and in the bounded pool
+def run(clients=16, duration=5, rounds=12, status_per_login=4):
+    app = create_app()
+    use_sqlite(app)
+    app.config['BCRYPT_LOG_ROUNDS'] = rounds
+    # every simulated client shares one address, so login throttling is off
+    app.config['LOGIN_RATE_LIMIT_ENABLED'] = False
+    app.test_client().post(
+        '/auth/register',
+        data=json.dumps(dict(email=EMAIL, password=PASSWORD)),
+        content_type='application/json'
+    )
+    results = {}
+    for enabled in (False, True):
+        app.config['BCRYPT_POOL_ENABLED'] = enabled
+        results['pool' if enabled else 'inline'] = _run_mixed(app, clients, duration, status_per_login)
+    app.extensions['hashing_pool'].shutdown()
+    return results
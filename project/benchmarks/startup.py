@@ -0,0 +1,45 @@
+# project/benchmarks/startup.py
+import json
+import os
+import subprocess
+import sys
+
+# Runs in a fresh interpreter so every import is cold; /metrics needs no database
+PROBE = '''
+import json, time
+start = time.perf_counter()
+from project.server import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+response = app.test_client().get('/metrics')
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({
+    'import': imported - start,
+    'create_app': created - imported,
+    'first_request': served - created,
+    'total': served - start
+}))
+'''
+
+PHASES = ('import', 'create_app', 'first_request', 'total')
+
+
+def _probe():
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    output = subprocess.check_output([sys.executable, '-c', PROBE], cwd=root)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+# Times import, app creation and the first request over `runs` cold processes
+def run(runs=5):
+    samples = [_probe() for _ in range(runs)]
+    results = {'runs': runs}
+    for phase in PHASES:
+        values = sorted(sample[phase] for sample in samples)
+        results[phase] = {
+            'median_ms': values[len(values) // 2] * 1000,
+            'max_ms': values[-1] * 1000
+        }
+    return results
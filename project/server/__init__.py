@@ -6,18 +6,46 @@ from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 
-app = Flask(__name__)
-CORS(app)
+# Extensions are created unbound and attached to each app in create_app
+bcrypt = Bcrypt()
+db = SQLAlchemy()
 
-app_settings = os.getenv(
-    'APP_SETTINGS',
-    'project.server.config.DevelopmentConfig'
-)
-app.config.from_object(app_settings)
 
-bcrypt = Bcrypt(app)
-db = SQLAlchemy(app)
+# Builds an app for the given config object (or import path); APP_SETTINGS by default.
+# Every app gets its own caches, hashing pool, revocation store, login limiter, bus and
+# keyring in app.extensions, so several apps can live in one process.
+def create_app(config=None):
+    app = Flask(__name__)
+    CORS(app)
 
-# Registering the authentication blueprint with the app
-from project.server.auth.views import auth_blueprint
-app.register_blueprint(auth_blueprint)
+    if config is None:
+        config = os.getenv(
+            'APP_SETTINGS',
+            'project.server.config.DevelopmentConfig'
+        )
+    app.config.from_object(config)
+
+    bcrypt.init_app(app)
+    db.init_app(app)
+
+    # Creates this app's caches, pools and keys; the bus comes first, as models
+    # subscribes its cache invalidations to it
+    from project.server import bus, hashing, models, ratelimit, revocation, signing
+    for module in (bus, hashing, models, ratelimit, revocation, signing):
+        module.init_app(app)
+
+    # Registering the authentication blueprint with the app
+    from project.server.auth.views import auth_blueprint
+    app.register_blueprint(auth_blueprint)
+
+    # Prometheus metrics endpoint and Server-Timing headers
+    from project.server.metrics import metrics_blueprint
+    app.register_blueprint(metrics_blueprint)
+
+    # Periodically deletes expired blacklist rows when a sweep interval is configured
+    if app.config.get('BLACKLIST_SWEEP_INTERVAL'):
+        from project.server.sweeper import BlacklistSweeper
+        app.extensions['blacklist_sweeper'] = BlacklistSweeper(app)
+        app.extensions['blacklist_sweeper'].start()
+
+    return app
@@ -0,0 +1,88 @@
+# project/server/auth/decorators.py
+from functools import wraps
+
+from flask import g, request, make_response, jsonify
+from werkzeug.local import LocalProxy
+
+from project.server.models import User
+
+
+def _fail(message, status):
+    responseObject = {
+        'status': 'fail',
+        'message': message
+    }
+    return make_response(jsonify(responseObject)), status
+
+
+# Parses, verifies and blacklist-checks the bearer token at most once per request.
+# On success g.auth_token, g.auth_payload and g.user_id are set; otherwise the
+# error message is returned along with whether a token was supplied at all.
+def authenticate():
+    if 'auth_result' not in g:
+        auth_header = request.headers.get('Authorization')
+        g.auth_result = (None, False)
+        if auth_header:
+            try:
+                auth_token = auth_header.split(" ")[1]
+            except IndexError:
+                g.auth_result = ('Bearer token malformed.', True)
+                return g.auth_result
+            if auth_token:
+                resp = User.decode_auth_payload(auth_token)
+                if isinstance(resp, str):
+                    g.auth_result = (resp, True)
+                else:
+                    g.auth_token = auth_token
+                    g.auth_payload = resp
+                    g.user_id = resp['sub']
+                    g.auth_result = (None, True)
+    return g.auth_result
+
+
+# Forgets the previous request's identity; g can outlive a request when an app
+# context was already pushed, e.g. in tests or CLI commands
+def reset_auth_state():
+    for name in ('auth_result', 'auth_token', 'auth_payload', 'user_id', '_current_user'):
+        g.pop(name, None)
+
+
+# The authenticated user as a read-only UserRecord, from the user cache when possible
+def get_current_user():
+    if '_current_user' not in g:
+        g._current_user = None
+        if g.get('user_id') is not None:
+            g._current_user = User.load_record(g.user_id)
+    return g._current_user
+
+
+current_user = LocalProxy(get_current_user)
+
+
+# Rejects requests without a valid bearer token. Usable bare or with arguments,
+# e.g. as a MethodView decorator: decorators = [login_required(missing_status=403)]
+def login_required(view=None, missing_status=401):
+    if view is None:
+        return lambda view: login_required(view, missing_status)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        error, supplied = authenticate()
+        if not supplied:
+            return _fail('Provide a valid auth token.', missing_status)
+        if error:
+            return _fail(error, 401)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# Like login_required, but the user must also be an admin
+def admin_required(view):
+    @login_required
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user = get_current_user()
+        if user is None or not user.admin:
+            return _fail('Admin privileges required.', 403)
+        return view(*args, **kwargs)
+    return wrapper
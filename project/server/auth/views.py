@@ -1,67 +1,104 @@
-from flask import Blueprint, request, make_response, jsonify
+import datetime
+import itertools
+import uuid
+
+from flask import Blueprint, current_app, g, request, make_response, jsonify
 from flask.views import MethodView
+from sqlalchemy.exc import IntegrityError
 
-from project.server import bcrypt, db
-from project.server.models import User, BlacklistToken
+from project.server import db, importer, signing
+from project.server.auth.decorators import admin_required, current_user, login_required, reset_auth_state
+from project.server.hashing import PoolSaturated, check_password_hash, needs_rehash
+from project.server.models import User, BlacklistToken, RefreshToken
+from project.server.ratelimit import client_addr, limiter
 
 auth_blueprint = Blueprint('auth', __name__)
+auth_blueprint.before_app_request(reset_auth_state)
+
+# Fast rejection used when the password hashing pool is saturated
+def busy_response():
+    responseObject = {
+        'status': 'fail',
+        'message': 'Server is busy. Please try again.'
+    }
+    response = make_response(jsonify(responseObject))
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 # A new user is registered and a new auth token for further requests is generated, which we send back to the client.
 class RegisterAPI(MethodView):
 
     def post(self):
         # get the post data
-        post_data = request.get_json()
-        # check if user already exists
-        user = User.query.filter_by(email=post_data.get('email')).first()
-        if not user:
-            try:
-                user = User(email=post_data.get('email'), password=post_data.get('password'))
-
-                # insert the user
-                db.session.add(user)
-                db.session.commit()
-                # generate the auth token
-                auth_token = user.encode_auth_token(user.id)
-                responseObject = {
-                    'status': 'success',
-                    'message': 'Successfully registered.',
-                    'auth_token': auth_token.decode()
-                }
-                return make_response(jsonify(responseObject)), 201
-            except Exception as e:
+        post_data = request.get_json() or {}
+        try:
+            # a single insert; the unique email constraint detects existing users
+            user = User.insert_unique(email=post_data.get('email'), password=post_data.get('password'))
+            if user is None:
                 responseObject = {
                     'status': 'fail',
-                    'message': 'Some error occurred. Please try again.'
+                    'message': 'User already exists. Please Log in.',
                 }
-                return make_response(jsonify(responseObject)), 401
-        else:
+                return make_response(jsonify(responseObject)), 202
+            # generate the auth token
+            auth_token = user.encode_auth_token(user.id)
+            responseObject = {
+                'status': 'success',
+                'message': 'Successfully registered.',
+                'auth_token': auth_token.decode()
+            }
+            return make_response(jsonify(responseObject)), 201
+        except PoolSaturated:
+            return busy_response()
+        except Exception as e:
             responseObject = {
                 'status': 'fail',
-                'message': 'User already exists. Please Log in.',
+                'message': 'Some error occurred. Please try again.'
             }
-            return make_response(jsonify(responseObject)), 202
+            return make_response(jsonify(responseObject)), 401
 
 # User login resource
 class LoginAPI(MethodView):
 
     def post(self):
         # get the post data
-        post_data = request.get_json()
+        post_data = request.get_json() or {}
+        if not isinstance(post_data, dict):
+            responseObject = {
+                'status': 'fail',
+                'message': 'Expected a JSON object.'
+            }
+            return make_response(jsonify(responseObject)), 400
+        # throttle before any database or hashing work
+        retry_after = limiter.check(post_data.get('email'), client_addr())
+        if retry_after:
+            responseObject = {
+                'status': 'fail',
+                'message': 'Too many login attempts. Please try again later.'
+            }
+            response = make_response(jsonify(responseObject))
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
         try:
             # fetch the user data
             user = User.query.filter_by(
                 email=post_data.get('email')
             ).first()
-            if user and bcrypt.check_password_hash(
+            if user and check_password_hash(
                 user.password, post_data.get('password')
             ):
-                auth_token = user.encode_auth_token(user.id)
+                if current_app.config.get('BCRYPT_REHASH_ON_LOGIN') and needs_rehash(user.password):
+                    user.rehash_password_later(post_data.get('password'))
+                family_id = uuid.uuid4().hex
+                auth_token = user.encode_auth_token(user.id, family_id)
                 if auth_token:
+                    refresh_token = RefreshToken.issue(user.id, family_id)
+                    db.session.commit()
                     responseObject = {
                         'status': 'success',
                         'message': 'Successfully logged in.',
-                        'auth_token': auth_token.decode()
+                        'auth_token': auth_token.decode(),
+                        'refresh_token': refresh_token
                     }
                     return make_response(jsonify(responseObject)), 200
             else:
@@ -70,6 +107,8 @@ class LoginAPI(MethodView):
                     'message': 'User does not exist.'
                 }
                 return make_response(jsonify(responseObject)), 404
+        except PoolSaturated:
+            return busy_response()
         except Exception as e:
             print(e)
             responseObject = {
@@ -79,97 +118,202 @@ class LoginAPI(MethodView):
             return make_response(jsonify(responseObject)), 500
 
 class UserAPI(MethodView):
-  
+    decorators = [login_required]
+
     def get(self):
-        # get the auth token
-        auth_header = request.headers.get('Authorization')
-        if auth_header:
-            try:
-                auth_token = auth_header.split(" ")[1]
-            except IndexError:
-                responseObject = {
-                    'status': 'fail',
-                    'message': 'Bearer token malformed.'
-                }
-                return make_response(jsonify(responseObject)), 401
-        else:
-            auth_token = ''
-        if auth_token:
-            resp = User.decode_auth_token(auth_token)
-            if not isinstance(resp, str):
-                user = User.query.filter_by(id=resp).first()
-                responseObject = {
-                    'status': 'success',
-                    'data': {
-                        'user_id': user.id,
-                        'email': user.email,
-                        'admin': user.admin,
-                        'registered_on': user.registered_on
-                    }
+        if current_app.config.get('TOKEN_IDENTITY_CLAIMS') and 'email' in g.auth_payload:
+            # served from the verified claims, without touching the database
+            responseObject = {
+                'status': 'success',
+                'data': {
+                    'user_id': g.user_id,
+                    'email': g.auth_payload['email'],
+                    'admin': g.auth_payload['admin'],
+                    'registered_on': datetime.datetime.utcfromtimestamp(g.auth_payload['registered_on'])
                 }
-                return make_response(jsonify(responseObject)), 200
+            }
+            return make_response(jsonify(responseObject)), 200
+        user = current_user._get_current_object()
+        if user is None:
             responseObject = {
                 'status': 'fail',
-                'message': resp
+                'message': 'User not found.'
             }
             return make_response(jsonify(responseObject)), 401
-        else:
+        responseObject = {
+            'status': 'success',
+            'data': {
+                'user_id': user.id,
+                'email': user.email,
+                'admin': user.admin,
+                'registered_on': user.registered_on
+            }
+        }
+        return make_response(jsonify(responseObject)), 200
+
+class LogoutAPI(MethodView):
+    decorators = [login_required(missing_status=403)]
+
+    def post(self):
+        try:
+            # mark the token as blacklisted in the revocation store
+            BlacklistToken.revoke(g.auth_token, g.auth_payload)
+            # and end the session, so its refresh token cannot mint new tokens
+            if g.auth_payload.get('fid'):
+                RefreshToken.revoke_family(g.auth_payload['fid'])
+                db.session.commit()
+            User.evict_auth_token(g.auth_token)
+            responseObject = {
+                'status': 'success',
+                'message': 'Successfully logged out.'
+            }
+            return make_response(jsonify(responseObject)), 200
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.exception('Logout failed')
             responseObject = {
                 'status': 'fail',
-                'message': 'Provide a valid auth token.'
+                'message': 'Some error occurred. Please try again.'
             }
-            return make_response(jsonify(responseObject)), 401
+            return make_response(jsonify(responseObject)), 500
 
-class LogoutAPI(MethodView):
+# Revokes every token of the current user, on all devices
+class LogoutAllAPI(MethodView):
+    decorators = [login_required(missing_status=403)]
 
     def post(self):
-        # get auth token
-        auth_header = request.headers.get('Authorization')
-        if auth_header:
-            auth_token = auth_header.split(" ")[1]
-        else:
-            auth_token = ''
-        if auth_token:
-            resp = User.decode_auth_token(auth_token)
-            if not isinstance(resp, str):
-                # mark the token as blacklisted
-                blacklist_token = BlacklistToken(token=auth_token)
-                try:
-                    # insert the token
-                    db.session.add(blacklist_token)
-                    db.session.commit()
-                    responseObject = {
-                        'status': 'success',
-                        'message': 'Successfully logged out.'
-                    }
-                    return make_response(jsonify(responseObject)), 200
-                except Exception as e:
-                    responseObject = {
-                        'status': 'fail',
-                        'message': e
-                    }
-                    return make_response(jsonify(responseObject)), 200
-            else:
-                responseObject = {
-                    'status': 'fail',
-                    'message': resp
-                }
-                return make_response(jsonify(responseObject)), 401
-        else:
+        User.revoke_all_tokens(g.user_id)
+        User.evict_auth_token(g.auth_token)
+        responseObject = {
+            'status': 'success',
+            'message': 'Successfully logged out of all sessions.'
+        }
+        return make_response(jsonify(responseObject)), 200
+
+# Lets an admin register many users at once from a CSV or JSON-lines body
+class BulkRegisterAPI(MethodView):
+    decorators = [admin_required]
+
+    def post(self):
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'jsonl'
+        max_users = current_app.config.get('BULK_REGISTER_MAX_USERS')
+        try:
+            records = list(itertools.islice(
+                importer.read_records(importer.text_stream(request.stream), fmt), max_users + 1))
+        except ValueError:
+            responseObject = {
+                'status': 'fail',
+                'message': 'Malformed user records.'
+            }
+            return make_response(jsonify(responseObject)), 400
+        if len(records) > max_users:
+            responseObject = {
+                'status': 'fail',
+                'message': 'At most {} users can be registered at once.'.format(max_users)
+            }
+            return make_response(jsonify(responseObject)), 413
+        try:
+            stats = importer.import_users(records)
+        except IntegrityError:
+            responseObject = {
+                'status': 'fail',
+                'message': 'Concurrent registrations conflicted with the import. Please try again.'
+            }
+            return make_response(jsonify(responseObject)), 409
+        responseObject = {
+            'status': 'success',
+            'message': 'Successfully registered {} users.'.format(stats['imported']),
+            'imported': stats['imported'],
+            'duplicates': stats['duplicates'],
+            'invalid': stats['invalid']
+        }
+        return make_response(jsonify(responseObject)), 201
+
+# Validates a batch of tokens with set-based blacklist and user lookups
+class IntrospectAPI(MethodView):
+
+    def post(self):
+        # get the post data
+        post_data = request.get_json() or {}
+        tokens = post_data.get('tokens')
+        if not isinstance(tokens, list) or not all(isinstance(token, str) for token in tokens):
+            responseObject = {
+                'status': 'fail',
+                'message': 'Provide a list of tokens.'
+            }
+            return make_response(jsonify(responseObject)), 400
+        max_tokens = current_app.config.get('INTROSPECT_MAX_TOKENS')
+        if len(tokens) > max_tokens:
+            responseObject = {
+                'status': 'fail',
+                'message': 'At most {} tokens can be introspected at once.'.format(max_tokens)
+            }
+            return make_response(jsonify(responseObject)), 413
+        responseObject = {
+            'status': 'success',
+            'results': User.introspect_tokens(tokens)
+        }
+        return make_response(jsonify(responseObject)), 200
+
+# Exchanges a refresh token for a new access token without a password check
+class RefreshAPI(MethodView):
+
+    def post(self):
+        # get the post data
+        post_data = request.get_json() or {}
+        refresh_token = post_data.get('refresh_token')
+        if not refresh_token:
             responseObject = {
                 'status': 'fail',
-                'message': 'Provide a valid auth token.'
+                'message': 'Provide a valid refresh token.'
             }
-            return make_response(jsonify(responseObject)), 403
+            return make_response(jsonify(responseObject)), 401
+        resp = RefreshToken.rotate(refresh_token)
+        if not isinstance(resp, str) and User.query.get(resp[1]) is None:
+            resp = 'Invalid refresh token. Please log in again.'
+        if isinstance(resp, str):
+            responseObject = {
+                'status': 'fail',
+                'message': resp
+            }
+            return make_response(jsonify(responseObject)), 401
+        refresh_token, user_id, family_id = resp
+        user = User.query.get(user_id)
+        auth_token = user.encode_auth_token(user.id, family_id)
+        responseObject = {
+            'status': 'success',
+            'message': 'Successfully refreshed.',
+            'auth_token': auth_token.decode(),
+            'refresh_token': refresh_token
+        }
+        return make_response(jsonify(responseObject)), 200
+
+# Publishes the public signing keys so other services can verify tokens locally
+class JWKSAPI(MethodView):
+
+    def get(self):
+        response = make_response(jsonify(signing.keyring.jwks()))
+        response.headers['Cache-Control'] = 'public, max-age={}'.format(current_app.config.get('JWKS_MAX_AGE'))
+        return response, 200
 
 # define the API resources
 registration_view = RegisterAPI.as_view('register_api')
 login_view = LoginAPI.as_view('login_api')
 user_view = UserAPI.as_view('user_api')
 logout_view = LogoutAPI.as_view('logout_api')
+logout_all_view = LogoutAllAPI.as_view('logout_all_api')
+bulk_registration_view = BulkRegisterAPI.as_view('bulk_register_api')
+introspect_view = IntrospectAPI.as_view('introspect_api')
+refresh_view = RefreshAPI.as_view('refresh_api')
+jwks_view = JWKSAPI.as_view('jwks_api')
 
 # add Rules for API Endpoints
 auth_blueprint.add_url_rule('/auth/register', view_func = registration_view, methods = ['POST'])
+auth_blueprint.add_url_rule('/auth/register/bulk', view_func = bulk_registration_view, methods = ['POST'])
 auth_blueprint.add_url_rule('/auth/login', view_func = login_view, methods = ['POST'])
 auth_blueprint.add_url_rule('/auth/status', view_func = user_view, methods = ['GET'])
 auth_blueprint.add_url_rule('/auth/logout', view_func = logout_view, methods = ['POST'])
+auth_blueprint.add_url_rule('/auth/logout_all', view_func = logout_all_view, methods = ['POST'])
+auth_blueprint.add_url_rule('/auth/introspect', view_func = introspect_view, methods = ['POST'])
+auth_blueprint.add_url_rule('/auth/refresh', view_func = refresh_view, methods = ['POST'])
+auth_blueprint.add_url_rule('/auth/jwks', view_func = jwks_view, methods = ['GET'])
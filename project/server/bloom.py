@@ -0,0 +1,57 @@
+# project/server/bloom.py
+import hashlib
+import math
+import threading
+
+
+# Probabilistic set: "not in the filter" is always right, "in the filter" may be a false positive
+class BloomFilter:
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        if capacity < 1:
+            capacity = 1
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # Optimal bit count and number of hash functions for the requested error rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._lock = threading.Lock()
+
+    # Double hashing: derives every bit position from one digest
+    def _positions(self, item):
+        digest = hashlib.sha256(str(item).encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        with self._lock:
+            for pos in positions:
+                self._bits[pos >> 3] |= 1 << (pos & 7)
+            self.count += 1
+
+    def __contains__(self, item):
+        bits = self._bits
+        for pos in self._positions(item):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+    # Fraction of bits set; the false-positive rate grows with it
+    def fill_ratio(self):
+        ones = sum(bin(byte).count('1') for byte in self._bits)
+        return ones / float(self.num_bits)
+
+    @classmethod
+    def from_items(cls, items, capacity=100000, error_rate=0.001):
+        items = list(items)
+        bloom = cls(max(capacity, 2 * len(items)), error_rate)
+        for item in items:
+            bloom.add(item)
+        return bloom
@@ -0,0 +1,145 @@
+# project/server/bus.py
+import glob
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+logger = logging.getLogger(__name__)
+
+
+# Broadcasts cache invalidations to the other worker processes on this host. Every
+# worker binds a Unix datagram socket in socket_dir and a publish is one non-blocking
+# sendto per peer, so a slow or dead worker never delays a request. A dropped
+# datagram only means the receiving cache serves the old entry until its TTL expires.
+# Handlers of a bus built for an app run inside that app's context.
+class InvalidationBus:
+
+    def __init__(self, socket_dir=None, name=None, enabled=True, app=None):
+        self.socket_dir = socket_dir or os.path.join(tempfile.gettempdir(), 'flask_jwt_auth_bus')
+        self.name = name
+        self.enabled = enabled
+        self.app = app
+        self.handlers = {}
+        self._socket = None
+        self._sender = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.socket_dir, '{}.sock'.format(self.name or os.getpid()))
+
+    def subscribe(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    # Binds this process's socket and starts its listener; safe to call on every
+    # request, and binds again in a child forked from a started parent
+    def start(self):
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if not os.path.isdir(self.socket_dir):
+                os.makedirs(self.socket_dir)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(self.path)
+            self._socket = sock
+            self._sender = None
+            self._pid = os.getpid()
+            listener = threading.Thread(target=self._listen, args=(sock,), name='invalidation-bus')
+            listener.daemon = True
+            listener.start()
+
+    def stop(self):
+        with self._lock:
+            if self._socket is not None and self._pid == os.getpid():
+                self._socket.close()
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+            self._socket = None
+            self._pid = None
+
+    def _listen(self, sock):
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                return
+            try:
+                message = json.loads(data.decode('utf-8'))
+            except ValueError:
+                continue
+            self.dispatch(message)
+
+    # Runs the handlers subscribed to the message's event
+    def dispatch(self, message):
+        if self.app is not None:
+            with self.app.app_context():
+                self._dispatch(message)
+        else:
+            self._dispatch(message)
+
+    def _dispatch(self, message):
+        for handler in self.handlers.get(message.get('event'), ()):
+            try:
+                handler(message)
+            except Exception:
+                logger.exception('Invalidation handler failed')
+
+    def _get_sender(self):
+        with self._lock:
+            if self._sender is None or self._sender[0] != os.getpid():
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                sock.setblocking(False)
+                self._sender = (os.getpid(), sock)
+            return self._sender[1]
+
+    # Sends an event to every other worker; peers that exited are forgotten
+    def publish(self, event, **fields):
+        if not self.enabled:
+            return
+        fields['event'] = event
+        data = json.dumps(fields).encode('utf-8')
+        own = self.path
+        sender = self._get_sender()
+        for path in glob.glob(os.path.join(self.socket_dir, '*.sock')):
+            if path == own:
+                continue
+            try:
+                sender.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            except OSError:
+                # the peer's queue is full; its caches catch up through their TTLs
+                pass
+
+
+# The current app's bus, created by init_app
+bus = LocalProxy(lambda: current_app.extensions['invalidation_bus'])
+
+
+def _start_bus():
+    bus.start()
+
+
+# Creates the app's bus and binds it in each worker on its first request
+def init_app(app):
+    app.extensions['invalidation_bus'] = InvalidationBus(
+        app.config.get('INVALIDATION_BUS_DIR'),
+        enabled=app.config.get('INVALIDATION_BUS_ENABLED'),
+        app=app
+    )
+    if app.config.get('INVALIDATION_BUS_ENABLED'):
+        app.before_request(_start_bus)
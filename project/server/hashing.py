@@ -0,0 +1,165 @@
+# project/server/hashing.py
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+
+import flask_bcrypt
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from project.server import db, metrics
+
+
+class PoolSaturated(Exception):
+    """Raised when the hashing pool has no free slot and the caller should shed load."""
+
+
+# Bounded executor for bcrypt work: at most `workers` running and `queue_depth` waiting
+class HashingPool:
+
+    def __init__(self, workers=4, queue_depth=32, kind='thread', timeout=None):
+        self._executor = None
+        self._lock = threading.Lock()
+        self.configure(workers, queue_depth, kind, timeout)
+
+    # Resizes the pool; the running executor, if any, is replaced on next use
+    def configure(self, workers, queue_depth, kind='thread', timeout=None):
+        self.shutdown(wait=False)
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.kind = kind
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+
+    # Executors are created on first use so pre-forked workers each get their own
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == 'process':
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    # The slot is returned to the semaphore it was taken from, even if configure()
+    # replaced the semaphore while the task was running
+    def submit(self, fn, *args):
+        slots = self._slots
+        if not slots.acquire(False):
+            raise PoolSaturated()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda f: slots.release())
+        return future
+
+    # Runs fn in the pool and waits for it; a request that waits too long is shed too
+    def run(self, fn, *args):
+        future = self.submit(fn, *args)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise PoolSaturated()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+# The current app's pool, created by init_app
+pool = LocalProxy(lambda: current_app.extensions['hashing_pool'])
+
+
+# Creates a pool sized from the app's config
+def init_app(app):
+    app.extensions['hashing_pool'] = HashingPool(
+        workers=app.config.get('BCRYPT_POOL_WORKERS'),
+        queue_depth=app.config.get('BCRYPT_POOL_QUEUE_DEPTH'),
+        kind=app.config.get('BCRYPT_POOL_KIND'),
+        timeout=app.config.get('BCRYPT_POOL_TIMEOUT')
+    )
+
+
+# Hashes a password with the configured cost, in the pool when it is enabled
+def generate_password_hash(password, rounds=None):
+    if rounds is None:
+        rounds = current_app.config.get('BCRYPT_LOG_ROUNDS')
+    with metrics.timed('bcrypt_hash'):
+        if not current_app.config.get('BCRYPT_POOL_ENABLED'):
+            return flask_bcrypt.generate_password_hash(password, rounds).decode()
+        return pool.run(flask_bcrypt.generate_password_hash, password, rounds).decode()
+
+
+# Verifies a password against a stored hash, in the pool when it is enabled
+def check_password_hash(pw_hash, password):
+    with metrics.timed('bcrypt_check'):
+        if not current_app.config.get('BCRYPT_POOL_ENABLED'):
+            return flask_bcrypt.check_password_hash(pw_hash, password)
+        return pool.run(flask_bcrypt.check_password_hash, pw_hash, password)
+
+
+# Cost factor encoded in a bcrypt hash such as "$2b$12$..."
+def hash_cost(pw_hash):
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+# True when a stored hash was made with a different cost than the configured one
+def needs_rehash(pw_hash, rounds=None):
+    if rounds is None:
+        rounds = current_app.config.get('BCRYPT_LOG_ROUNDS')
+    return hash_cost(pw_hash) != rounds
+
+
+# Single worker for maintenance jobs that must stay off the request path
+background = ThreadPoolExecutor(max_workers=1)
+_background_keys = set()
+_background_lock = threading.Lock()
+
+
+# Runs fn in the background worker inside the calling app's context. A job whose key
+# is already queued or running is skipped, and so is any job once BACKGROUND_QUEUE_SIZE
+# are waiting; both return None, and the caller may simply try again later.
+def run_in_background(fn, *args, key=None):
+    app = current_app._get_current_object()
+    with _background_lock:
+        if key in _background_keys or len(_background_keys) >= app.config.get('BACKGROUND_QUEUE_SIZE'):
+            return None
+        key = key if key is not None else object()
+        _background_keys.add(key)
+
+    def job():
+        with app.app_context():
+            try:
+                return fn(*args)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Background job failed')
+            finally:
+                db.session.remove()
+                with _background_lock:
+                    _background_keys.discard(key)
+    return background.submit(job)
+
+
+# Times one hash per cost and picks the largest cost within budget_ms
+def calibrate(budget_ms=250, min_rounds=4, max_rounds=16):
+    timings = []
+    best = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        start = time.time()
+        flask_bcrypt.generate_password_hash('calibration', rounds)
+        elapsed_ms = (time.time() - start) * 1000
+        timings.append((rounds, elapsed_ms))
+        if elapsed_ms > budget_ms:
+            break
+        best = rounds
+    return best, timings
@@ -0,0 +1,137 @@
+# project/server/importer.py
+import csv
+import datetime
+import io
+import json
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import flask_bcrypt
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from project.server import db
+from project.server.models import User
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 't')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# Process pool shared by imports; IMPORT_WORKERS = 0 hashes in the calling thread
+def get_executor():
+    global _executor
+    workers = current_app.config.get('IMPORT_WORKERS')
+    if workers == 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=workers)
+    return _executor
+
+
+# Runs in the worker processes, so it must stay a picklable module-level function
+def _hash_password(args):
+    password, rounds = args
+    return flask_bcrypt.generate_password_hash(password, rounds).decode()
+
+
+# Yields {'email', 'password', 'admin'} records from a CSV (with a header row) or
+# JSON-lines text stream, without reading the whole input into memory. Raises
+# ValueError for a line that is not JSON or not a JSON object.
+def read_records(stream, fmt='jsonl'):
+    if fmt == 'csv':
+        rows = csv.DictReader(stream)
+    else:
+        rows = (json.loads(line) for line in stream if line.strip())
+    for row in rows:
+        if not isinstance(row, dict):
+            raise ValueError('Expected a JSON object, got {!r}'.format(row))
+        admin = row.get('admin', False)
+        if not isinstance(admin, bool):
+            admin = str(admin).strip().lower() in TRUE_VALUES
+        yield {'email': row.get('email'), 'password': row.get('password'), 'admin': admin}
+
+
+# Wraps a binary stream (an upload or an open file) for read_records
+def text_stream(stream):
+    return io.TextIOWrapper(stream, encoding='utf-8')
+
+
+def _batches(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _is_text(value):
+    return isinstance(value, str) and bool(value)
+
+
+def _existing_emails(emails):
+    return set(row.email for row in db.session.query(User.email).filter(User.email.in_(emails)))
+
+
+# Imports users in batches: one existence query, one parallel hashing pass and one
+# batched insert per batch. Emails already present, or repeated in the input, are
+# skipped and reported. `progress` is called after every batch with the running stats.
+def import_users(records, batch_size=None, progress=None):
+    if batch_size is None:
+        batch_size = current_app.config.get('IMPORT_BATCH_SIZE')
+    rounds = current_app.config.get('BCRYPT_LOG_ROUNDS')
+    executor = get_executor()
+    stats = {'imported': 0, 'duplicates': [], 'invalid': 0, 'elapsed': 0.0}
+    seen = set()
+    start = time.time()
+
+    for batch in _batches(records, batch_size):
+        candidates = []
+        for record in batch:
+            if not _is_text(record['email']) or not _is_text(record['password']):
+                stats['invalid'] += 1
+            elif record['email'] in seen:
+                stats['duplicates'].append(record['email'])
+            else:
+                seen.add(record['email'])
+                candidates.append(record)
+
+        hashes = {}
+        for attempt in range(2):
+            existing = _existing_emails([record['email'] for record in candidates]) if candidates else set()
+            new = [record for record in candidates if record['email'] not in existing]
+            pending = [record for record in new if record['email'] not in hashes]
+            args = [(record['password'], rounds) for record in pending]
+            if executor is None:
+                hashed = [_hash_password(arg) for arg in args]
+            else:
+                hashed = executor.map(_hash_password, args, chunksize=16)
+            hashes.update(zip([record['email'] for record in pending], hashed))
+            now = datetime.datetime.now()
+            rows = [
+                {'email': record['email'], 'password': hashes[record['email']],
+                 'registered_on': now, 'admin': record['admin']}
+                for record in new
+            ]
+            try:
+                if rows:
+                    db.session.execute(User.__table__.insert(), rows)
+                db.session.commit()
+                break
+            except IntegrityError:
+                # a concurrent registration took one of the emails; look again once
+                db.session.rollback()
+                if attempt:
+                    raise
+        stats['duplicates'].extend(sorted(existing))
+        stats['imported'] += len(rows)
+        stats['elapsed'] = time.time() - start
+        if progress is not None:
+            progress(stats)
+    return stats
@@ -0,0 +1,149 @@
+# project/server/metrics.py
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Blueprint, current_app, g, has_request_context, make_response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+metrics_blueprint = Blueprint('metrics', __name__)
+
+# Upper bounds in seconds; bcrypt lands in the top buckets, cache hits in the bottom ones
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+# Fixed-bucket latency histogram; observing is a bisect and three additions
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+    # Cumulative (upper bound, count) pairs, ending with +Inf
+    def cumulative(self):
+        with self._lock:
+            counts = list(self.counts)
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+histograms = {}
+caches = {}
+_registry_lock = threading.Lock()
+
+
+def histogram(operation):
+    hist = histograms.get(operation)
+    if hist is None:
+        with _registry_lock:
+            hist = histograms.setdefault(operation, Histogram())
+    return hist
+
+
+# Records the duration of an operation, and adds it to the request's Server-Timing
+def observe(operation, seconds):
+    histogram(operation).observe(seconds)
+    if has_request_context():
+        timings = g.setdefault('server_timing', {})
+        timings[operation] = timings.get(operation, 0.0) + seconds
+
+
+@contextmanager
+def timed(operation):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(operation, time.perf_counter() - start)
+
+
+# Exposes a TTLCache's size and hit/miss counters on /metrics
+def register_cache(name, cache):
+    caches[name] = cache
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+# Renders every histogram and cache in the Prometheus text exposition format
+def render():
+    lines = [
+        '# HELP flask_jwt_auth_operation_seconds Time spent in hot-path operations.',
+        '# TYPE flask_jwt_auth_operation_seconds histogram'
+    ]
+    for operation in sorted(histograms):
+        hist = histograms[operation]
+        for bound, count in hist.cumulative():
+            lines.append('flask_jwt_auth_operation_seconds_bucket{{operation="{}",le="{}"}} {}'.format(
+                operation, _format_bound(bound), count))
+        lines.append('flask_jwt_auth_operation_seconds_sum{{operation="{}"}} {!r}'.format(operation, hist.sum))
+        lines.append('flask_jwt_auth_operation_seconds_count{{operation="{}"}} {}'.format(operation, hist.count))
+    for metric, kind, help_text in (
+            ('hits', 'counter', 'Cache lookups answered from memory.'),
+            ('misses', 'counter', 'Cache lookups that fell through.'),
+            ('size', 'gauge', 'Entries currently cached.')):
+        lines.append('# HELP flask_jwt_auth_cache_{} {}'.format(metric, help_text))
+        lines.append('# TYPE flask_jwt_auth_cache_{} {}'.format(metric, kind))
+        for name in sorted(caches):
+            lines.append('flask_jwt_auth_cache_{}{{cache="{}"}} {}'.format(
+                metric, name, caches[name].stats()[metric]))
+    return '\n'.join(lines) + '\n'
+
+
+# Times every SQL statement, labelled by its verb (sql_select, sql_insert, ...)
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['query_start'].pop()
+    verb = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else 'other'
+    observe('sql_' + verb, time.perf_counter() - start)
+
+
+# A failed statement never reaches after_cursor_execute, so its start time is dropped here
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_start'):
+        conn.info['query_start'].pop()
+
+
+@metrics_blueprint.before_app_request
+def reset_server_timing():
+    g.pop('server_timing', None)
+
+
+@metrics_blueprint.after_app_request
+def add_server_timing(response):
+    if current_app.config.get('METRICS_SERVER_TIMING') and g.get('server_timing'):
+        response.headers['Server-Timing'] = ', '.join(
+            '{};dur={:.3f}'.format(operation, seconds * 1000)
+            for operation, seconds in sorted(g.server_timing.items()))
+    return response
+
+
+@metrics_blueprint.route('/metrics', methods=['GET'])
+def metrics():
+    response = make_response(render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response, 200
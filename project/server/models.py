@@ -1,6 +1,96 @@
+import calendar
 import datetime
+import hashlib
+import secrets
+import time
+import threading
+import uuid
 import jwt
-from project.server import app, db, bcrypt
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from werkzeug.local import LocalProxy
+from project.server import db
+from project.server import hashing, metrics, revocation, signing
+from project.server.bloom import BloomFilter
+from project.server.bus import bus
+from project.server.cache import TTLCache
+
+# Each app keeps its own caches in app.extensions['auth_caches'], created by init_app;
+# the names below resolve to the current app's cache
+CACHE_SETTINGS = (
+    # Caches blacklist lookups so repeated status checks skip the database
+    ('blacklist', 'BLACKLIST_CACHE_SIZE', 'BLACKLIST_CACHE_TTL'),
+    # Verified token payloads, so repeat requests skip signature checks and JSON parsing
+    ('decode', 'DECODE_CACHE_SIZE', 'DECODE_CACHE_TTL'),
+    # Users whose email or admin flag changed recently, mapped to the time of the change.
+    # Tokens carrying identity claims issued before that time are rejected.
+    ('identity_change', 'IDENTITY_CHANGE_CACHE_SIZE', 'IDENTITY_CHANGE_TTL'),
+    # Current token_version of recently seen users, so the version check skips the database
+    ('token_version', 'TOKEN_VERSION_CACHE_SIZE', 'TOKEN_VERSION_CACHE_TTL'),
+    # UserRecord snapshots of recently authenticated users, dropped when the user changes
+    ('user', 'USER_CACHE_SIZE', 'USER_CACHE_TTL')
+)
+
+
+def _app_cache(name):
+    return LocalProxy(lambda: current_app.extensions['auth_caches'][name])
+
+
+blacklist_cache = _app_cache('blacklist')
+token_cache = _app_cache('decode')
+identity_changes = _app_cache('identity_change')
+token_versions = _app_cache('token_version')
+user_records = _app_cache('user')
+
+metrics.register_cache('blacklist', blacklist_cache)
+metrics.register_cache('decode', token_cache)
+metrics.register_cache('token_version', token_versions)
+metrics.register_cache('user', user_records)
+
+# Bloom filter of revoked tokens, built from blacklist_tokens on first use
+blacklist_bloom = LocalProxy(lambda: current_app.extensions['blacklist_bloom'])
+# _bloom_lock guards the filter itself and is only held briefly; _rebuild_lock lets
+# a single thread scan the table while the others keep using the current filter
+_bloom_lock = threading.Lock()
+_rebuild_lock = threading.Lock()
+
+
+# Creates the app's caches and bloom filter state, and applies the invalidations
+# other workers publish on the app's bus to them
+def init_app(app):
+    app.extensions['auth_caches'] = dict(
+        (name, TTLCache(app.config.get(size), app.config.get(ttl)))
+        for name, size, ttl in CACHE_SETTINGS
+    )
+    app.extensions['blacklist_bloom'] = {'filter': None, 'built_at': 0.0, 'pending': None}
+    app_bus = app.extensions['invalidation_bus']
+    app_bus.subscribe('revoked', _on_revoked)
+    app_bus.subscribe('token_evicted', _on_token_evicted)
+    app_bus.subscribe('user_changed', _on_user_changed)
+
+
+# Fixed-size digest of a raw token, used as a cache and revocation key
+def token_digest(auth_token):
+    if not isinstance(auth_token, bytes):
+        auth_token = str(auth_token).encode('utf-8')
+    return hashlib.sha256(auth_token).hexdigest()
+
+# Read-only snapshot of a user row, cheap to build and safe to share between requests
+class UserRecord:
+    __slots__ = ('id', 'email', 'admin', 'registered_on', 'token_version')
+
+    def __init__(self, id, email, admin, registered_on, token_version):
+        for name, value in zip(self.__slots__, (id, email, admin, registered_on, token_version)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('UserRecord is read-only')
+
+    def __repr__(self):
+        return '<UserRecord {}: {}>'.format(self.id, self.email)
 
 # User model for storing user-based details
 class User(db.Model):
@@ -11,27 +101,98 @@ class User(db.Model):
     password = db.Column(db.String(255), nullable=False)
     registered_on = db.Column(db.DateTime, nullable=False)
     admin = db.Column(db.Boolean, nullable=False, default=False)
+    # Embedded in every token; bumping it revokes all of the user's tokens at once
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __init__(self, email, password, admin=False):
         self.email = email
-        self.password = bcrypt.generate_password_hash(password, app.config.get('BCRYPT_LOG_ROUNDS')).decode()
+        self.password = hashing.generate_password_hash(password, current_app.config.get('BCRYPT_LOG_ROUNDS'))
         self.registered_on = datetime.datetime.now()
         self.admin = admin
-    
+
+    @staticmethod
+    # Registers a user with an INSERT that relies on the unique email constraint, so
+    # concurrent registrations cannot both succeed. Emails already taken are answered
+    # by a primary-key-only lookup first, before any password hashing. Returns the new
+    # (transient) user with its id set, or None when the email is already taken.
+    def insert_unique(email, password, admin=False):
+        if db.session.query(User.id).filter_by(email=email).first() is not None:
+            return None
+        user = User(email=email, password=password, admin=admin)
+        values = {
+            'email': user.email,
+            'password': user.password,
+            'registered_on': user.registered_on,
+            'admin': user.admin
+        }
+        if db.engine.dialect.name == 'postgresql':
+            statement = postgresql.insert(User.__table__).values(**values) \
+                .on_conflict_do_nothing(index_elements=['email']) \
+                .returning(User.__table__.c.id)
+            row = db.session.execute(statement).first()
+            db.session.commit()
+            if row is None:
+                return None
+            user.id = row[0]
+            return user
+        # other databases: a plain INSERT, with a duplicate surfacing as IntegrityError
+        try:
+            result = db.session.execute(User.__table__.insert().values(**values))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            if db.session.query(User.id).filter_by(email=email).first():
+                return None
+            raise
+        user.id = result.inserted_primary_key[0]
+        return user
+
+    # Upgrades the stored hash to the configured cost without delaying the request.
+    # Returns None when this user's rehash is already queued or the queue is full;
+    # the next login tries again.
+    def rehash_password_later(self, password):
+        return hashing.run_in_background(
+            User.rehash_password, self.id, self.password, password, key=('rehash', self.id))
+
+    @staticmethod
+    # Replaces the hash only if it is unchanged, so a concurrent password change wins
+    def rehash_password(user_id, old_hash, password):
+        new_hash = hashing.generate_password_hash(password)
+        User.query.filter_by(id=user_id, password=old_hash).update(
+            {'password': new_hash}, synchronize_session=False)
+        db.session.commit()
+        User.publish_change(user_id)
+
     # Generates the authentication token
-    def encode_auth_token(self, user_id):
+    # family_id links the token to the refresh token family of its login session
+    def encode_auth_token(self, user_id, family_id=None):
 
         try:
             payload = {
                 # Token's expiry date
-                'exp': datetime.datetime.utcnow() + datetime.timedelta(days=0, seconds=5),
+                'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=current_app.config.get('ACCESS_TOKEN_TTL')),
                 # The time when the token was generated
                 'iat': datetime.datetime.utcnow(),
                 # The owner (user) of the token
-                'sub': user_id
+                'sub': user_id,
+                # Unique token id, used as the key when the token is revoked
+                'jti': uuid.uuid4().hex,
+                # The user's token version; tokens with an older one are rejected
+                'ver': self.token_version or 0
             }
+            if family_id:
+                # Lets logout revoke the refresh tokens of this session
+                payload['fid'] = family_id
+            if current_app.config.get('TOKEN_IDENTITY_CLAIMS'):
+                # Lets /auth/status answer from the token alone
+                payload['email'] = self.email
+                payload['admin'] = self.admin
+                payload['registered_on'] = calendar.timegm(self.registered_on.utctimetuple())
+                # iat only has whole seconds; identity changes are compared in milliseconds
+                payload['iat_ms'] = int(time.time() * 1000)
 
-            return jwt.encode(payload, app.config.get('SECRET_KEY'), algorithm='HS256')
+            with metrics.timed('jwt_encode'):
+                return signing.encode(payload)
 
         except Exception as e:
             return e
@@ -39,20 +200,29 @@ class User(db.Model):
     @staticmethod
     # Decodes the authentication token
     def decode_auth_token(auth_token):
+        payload = User.decode_auth_payload(auth_token)
+        if isinstance(payload, str):
+            return payload
+        # If the auth token is valid, the user id is returned
+        return payload["sub"]
+
+    @staticmethod
+    # Decodes the authentication token into its verified payload, or an error message
+    def decode_auth_payload(auth_token):
         try:
             # The token is decoded with every API request and its signature is 
             # verified to validate the user's authenticity
-            payload = jwt.decode(auth_token, app.config.get("SECRET_KEY"))
-            is_blacklisted_token = BlacklistToken.check_blacklist(auth_token)
+            payload = User.verify_auth_token(auth_token)
+            is_blacklisted_token = BlacklistToken.check_blacklist(auth_token, payload)
             
             # handles blacklisted tokens after the decoding and responding with appropriate message.
             if is_blacklisted_token:
                 return "Token blacklisted. Please log in again."
-            else:
-                return payload["sub"]
-            
-            # If the auth token is valid, the user id is returned
-            return payload["sub"] 
+            if User.token_version_changed(payload['sub'], payload.get('ver', 0)):
+                return "Token revoked. Please log in again."
+            if 'email' in payload and User.identity_changed_since(payload['sub'], payload):
+                return "User details changed. Please log in again."
+            return payload
         except jwt.ExpiredSignatureError:
              # Token is used after it has expired
             return "Signature expired. Please log in again."
@@ -60,26 +230,447 @@ class User(db.Model):
             # The token is incorrect/malformed
             return "Invalid token. Please log in again."
 
+    @staticmethod
+    # Validates many tokens at once: signatures are checked per token, but revocation
+    # and user details are resolved with one query each. Returns one result per token.
+    def introspect_tokens(auth_tokens):
+        results = []
+        payloads = {}
+        for index, auth_token in enumerate(auth_tokens):
+            try:
+                payloads[index] = User.verify_auth_token(auth_token)
+                results.append(None)
+            except jwt.ExpiredSignatureError:
+                results.append({'active': False, 'message': "Signature expired. Please log in again."})
+            except jwt.InvalidTokenError:
+                results.append({'active': False, 'message': "Invalid token. Please log in again."})
+
+        keys = dict((index, BlacklistToken.token_key(auth_tokens[index], payload))
+                    for index, payload in payloads.items())
+        revoked = BlacklistToken.check_blacklist_many(
+            dict((keys[index], payload.get('exp')) for index, payload in payloads.items()))
+        user_ids = set(payload['sub'] for payload in payloads.values())
+        users = dict((user.id, user) for user in User.query.filter(User.id.in_(user_ids))) if user_ids else {}
+
+        for index, payload in payloads.items():
+            user = users.get(payload['sub'])
+            if keys[index] in revoked:
+                results[index] = {'active': False, 'message': "Token blacklisted. Please log in again."}
+            elif user is None:
+                results[index] = {'active': False, 'message': "User not found."}
+            elif payload.get('ver', 0) != user.token_version:
+                results[index] = {'active': False, 'message': "Token revoked. Please log in again."}
+            elif 'email' in payload and User.identity_changed_since(payload['sub'], payload):
+                results[index] = {'active': False, 'message': "User details changed. Please log in again."}
+            else:
+                results[index] = {
+                    'active': True,
+                    'user_id': user.id,
+                    'email': user.email,
+                    'admin': user.admin,
+                    'registered_on': user.registered_on,
+                    'exp': payload['exp']
+                }
+        return results
+
+    @staticmethod
+    # True when the user's email or admin flag changed after the token was issued.
+    # Both times are in milliseconds; a token without iat_ms counts from the end of
+    # its iat second, so it is only rejected by a change in a later second.
+    def identity_changed_since(user_id, payload):
+        changed_at = identity_changes.get(user_id)
+        if changed_at is None:
+            return False
+        issued_at = payload.get('iat_ms', payload['iat'] * 1000 + 999)
+        return issued_at < changed_at
+
+    @staticmethod
+    # The user's UserRecord, read with a column-only query on a cache miss; None if absent
+    def load_record(user_id):
+        record = user_records.get(user_id)
+        if record is None:
+            row = db.session.query(
+                User.id, User.email, User.admin, User.registered_on, User.token_version
+            ).filter_by(id=user_id).first()
+            if row is None:
+                return None
+            record = UserRecord(*row)
+            user_records.set(user_id, record)
+        return record
+
+    @staticmethod
+    # True when the user's tokens were revoked after one with this version was issued.
+    # A token newer than the cached version means the cache missed a revocation made
+    # on another worker, so the version is read again instead of rejecting the token.
+    def token_version_changed(user_id, version):
+        current = token_versions.get(user_id)
+        if current is None or version > current:
+            current = db.session.query(User.token_version).filter_by(id=user_id).scalar()
+            if current is None:
+                return False
+            token_versions.set(user_id, current)
+        return version < current
+
+    @staticmethod
+    # Revokes every token issued to the user so far with a single-row update, and
+    # revokes the user's refresh tokens so none of them can mint new access tokens
+    def revoke_all_tokens(user_id):
+        User.query.filter_by(id=user_id).update(
+            {'token_version': User.token_version + 1}, synchronize_session=False)
+        RefreshToken.query.filter_by(user_id=user_id, revoked=False).update(
+            {'revoked': True}, synchronize_session=False)
+        db.session.commit()
+        token_versions.pop(user_id)
+        user_records.pop(user_id)
+        User.publish_change(user_id)
+
+    @staticmethod
+    # Tells the other workers to drop what they cached about the user
+    def publish_change(user_id, identity_changed_at=None):
+        bus.publish('user_changed', id=user_id, identity_changed_at=identity_changed_at)
+
+    @staticmethod
+    # Verifies the token, reusing the payload of one already verified until it expires
+    def verify_auth_token(auth_token):
+        if not current_app.config.get('DECODE_CACHE_ENABLED'):
+            with metrics.timed('jwt_decode'):
+                return signing.decode(auth_token)
+        key = token_digest(auth_token)
+        payload = token_cache.get(key)
+        if payload is None:
+            with metrics.timed('jwt_decode'):
+                payload = signing.decode(auth_token)
+            token_cache.set(key, payload, payload['exp'] - time.time())
+        return payload
+
+    @staticmethod
+    # Drops a revoked token from the decode cache
+    def evict_auth_token(auth_token):
+        digest = token_digest(auth_token)
+        token_cache.pop(digest)
+        bus.publish('token_evicted', digest=digest)
+
+# Remembers every updated user, and whether its email or admin flag changed, so the
+# caches here and on the other workers can be updated once the change is committed
+@event.listens_for(User, 'after_update')
+def record_identity_change(mapper, connection, target):
+    state = inspect(target)
+    identity_changed = state.attrs.email.history.has_changes() or state.attrs.admin.history.has_changes()
+    pending = state.session.info.setdefault('changed_users', {})
+    pending[target.id] = identity_changed or pending.get(target.id, False)
+
+
+@event.listens_for(User, 'after_delete')
+def record_user_delete(mapper, connection, target):
+    inspect(target).session.info.setdefault('changed_users', {}).setdefault(target.id, False)
+
+
+# Cached records are only dropped once the change is committed, so a concurrent
+# request cannot cache the old row again in between. Identity changes are stamped
+# with the commit time: tokens issued before it may still carry the old claims.
+@event.listens_for(Session, 'after_commit')
+def publish_user_changes(session):
+    for user_id, identity_changed in session.info.pop('changed_users', {}).items():
+        changed_at = None
+        if identity_changed:
+            changed_at = int(time.time() * 1000)
+            identity_changes.set(user_id, changed_at)
+        user_records.pop(user_id)
+        User.publish_change(user_id, changed_at)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_user_changes(session):
+    session.info.pop('changed_users', None)
+
 # Token model for storing JWT tokens
 class BlacklistToken(db.Model):
     __tablename__ = 'blacklist_tokens'
 
-    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    token = db.Column(db.String(500), unique=True, nullable=False)
+    # Revocations are keyed by the token's jti and kept only until it expires
+    jti = db.Column(db.String(64), primary_key=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
     blacklisted_on = db.Column(db.DateTime, nullable=False)
 
-    def __init__(self, token):
-        self.token = token
+    # Rows per multi-row INSERT, within SQLite's limit of 999 bound parameters
+    INSERT_CHUNK = 300
+
+    def __init__(self, token, payload=None):
+        if payload is None:
+            payload = BlacklistToken.read_payload(token)
+        self.jti = BlacklistToken.token_key(token, payload)
+        if payload.get('exp') is not None:
+            self.expires_at = datetime.datetime.utcfromtimestamp(payload['exp'])
+        else:
+            self.expires_at = datetime.datetime.utcnow()
         self.blacklisted_on = datetime.datetime.now()
 
     def __repr__(self):
-        return '<id: token: {}'.format(self.token)
-      
+        return '<jti: {}>'.format(self.jti)
+
+    @staticmethod
+    # Reads the claims without verifying the signature; only used to derive the key
+    def read_payload(auth_token):
+        try:
+            return jwt.decode(auth_token, options={'verify_signature': False, 'verify_exp': False})
+        except jwt.InvalidTokenError:
+            return {}
+
+    @staticmethod
+    # Fixed-size revocation key: the jti claim, or a SHA-256 digest for tokens without one
+    def token_key(auth_token, payload=None):
+        if payload and payload.get('jti'):
+            return str(payload['jti'])
+        return token_digest(auth_token)
+
     @staticmethod
     # check whether auth token has been blacklisted
-    def check_blacklist(auth_token):
-        res = BlacklistToken.query.filter_by(token=str(auth_token)).first()
-        if res:
-            return True  
-        else:
-            return False
+    def check_blacklist(auth_token, payload=None):
+        with metrics.timed('check_blacklist'):
+            return BlacklistToken._check_blacklist(auth_token, payload)
+
+    @staticmethod
+    def _check_blacklist(auth_token, payload=None):
+        if payload is None:
+            payload = BlacklistToken.read_payload(auth_token)
+        key = BlacklistToken.token_key(auth_token, payload)
+        expires_at = payload.get('exp')
+        cached = blacklist_cache.get(key)
+        if cached is not None:
+            return cached
+        res = revocation.store.contains(key)
+        BlacklistToken.cache_result(key, res, expires_at)
+        return res
+
+    @staticmethod
+    # Resolves many revocation keys (mapped to their token's exp) with at most one
+    # store lookup for the cache misses. Returns the set of revoked keys.
+    def check_blacklist_many(expiries):
+        revoked = set()
+        unknown = []
+        for key in expiries:
+            cached = blacklist_cache.get(key)
+            if cached is None:
+                unknown.append(key)
+            elif cached:
+                revoked.add(key)
+        if unknown:
+            found = revocation.store.contains_many(unknown)
+            for key in unknown:
+                BlacklistToken.cache_result(key, key in found, expiries[key])
+            revoked.update(found)
+        return revoked
+
+    @staticmethod
+    # Inserts many revocations (keys mapped to their token's exp) in one transaction,
+    # as multi-row INSERTs of at most INSERT_CHUNK rows, skipping keys already stored.
+    # Returns the number of rows written.
+    def insert_many(expiries):
+        table = BlacklistToken.__table__
+        keys = list(expiries)
+        existing = set()
+        for start in range(0, len(keys), BlacklistToken.INSERT_CHUNK):
+            existing.update(row.jti for row in db.session.query(BlacklistToken.jti)
+                            .filter(BlacklistToken.jti.in_(keys[start:start + BlacklistToken.INSERT_CHUNK])))
+        now = datetime.datetime.now()
+        rows = [
+            {'jti': key, 'expires_at': datetime.datetime.utcfromtimestamp(expiries[key]), 'blacklisted_on': now}
+            for key in keys if key not in existing
+        ]
+        for start in range(0, len(rows), BlacklistToken.INSERT_CHUNK):
+            chunk = rows[start:start + BlacklistToken.INSERT_CHUNK]
+            if db.engine.dialect.name == 'postgresql':
+                statement = postgresql.insert(table).values(chunk).on_conflict_do_nothing(index_elements=['jti'])
+            else:
+                statement = table.insert().values(chunk)
+            db.session.execute(statement)
+        db.session.commit()
+        for row in rows:
+            add_to_bloom(row['jti'])
+        return len(rows)
+
+    @staticmethod
+    # Revokes a token in the configured store and marks it in the local cache
+    def revoke(auth_token, payload=None):
+        if payload is None:
+            payload = BlacklistToken.read_payload(auth_token)
+        key = BlacklistToken.token_key(auth_token, payload)
+        expires_at = payload.get('exp')
+        if expires_at is None:
+            expires_at = time.time()
+        revocation.store.add(key, expires_at)
+        BlacklistToken.cache_result(key, True, expires_at)
+        bus.publish('revoked', key=key, exp=expires_at)
+
+    @staticmethod
+    # Remembers a lookup result, never beyond the token's own expiry (a unix timestamp)
+    def cache_result(key, is_blacklisted, expires_at=None):
+        ttl = None
+        if expires_at is not None:
+            ttl = expires_at - time.time()
+        blacklist_cache.set(key, is_blacklisted, ttl)
+
+    @staticmethod
+    # Deletes expired revocations in batches of batch_size rows, committing after each
+    # batch so no single transaction holds locks for long. Returns the rows removed.
+    def prune_expired(batch_size=1000, now=None):
+        if now is None:
+            now = datetime.datetime.utcnow()
+        removed = 0
+        while True:
+            keys = [row.jti for row in db.session.query(BlacklistToken.jti)
+                    .filter(BlacklistToken.expires_at < now)
+                    .limit(batch_size)]
+            if not keys:
+                break
+            removed += BlacklistToken.query.filter(
+                BlacklistToken.jti.in_(keys)
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            if len(keys) < batch_size:
+                break
+        return removed
+
+    @staticmethod
+    # Asks the bloom filter; only a True answer needs confirming against the table
+    def might_be_blacklisted(key):
+        if not current_app.config.get('BLACKLIST_BLOOM_ENABLED'):
+            return True
+        bloom = blacklist_bloom['filter']
+        refresh = current_app.config.get('BLACKLIST_BLOOM_REFRESH')
+        if bloom is None:
+            bloom = BlacklistToken.rebuild_bloom(max_age=refresh)
+        elif refresh and time.monotonic() - blacklist_bloom['built_at'] > refresh:
+            # one request rebuilds the stale filter; the others keep using it meanwhile
+            bloom = BlacklistToken.rebuild_bloom(max_age=refresh, wait=False) or bloom
+        return key in bloom
+
+    @staticmethod
+    # Rebuilds the bloom filter from every key in the blacklist_tokens table. With
+    # max_age, a filter another thread rebuilt while this one waited is reused. With
+    # wait=False, returns None at once if a rebuild is already running.
+    def rebuild_bloom(max_age=None, wait=True):
+        if not _rebuild_lock.acquire(wait):
+            return None
+        try:
+            bloom = blacklist_bloom['filter']
+            if max_age is not None and bloom is not None and not (
+                    max_age and time.monotonic() - blacklist_bloom['built_at'] > max_age):
+                return bloom
+            # keys inserted during the scan are collected by add_to_bloom
+            with _bloom_lock:
+                blacklist_bloom['pending'] = []
+            try:
+                keys = [row.jti for row in db.session.query(BlacklistToken.jti)]
+                bloom = BloomFilter.from_items(
+                    keys,
+                    capacity=current_app.config.get('BLACKLIST_BLOOM_CAPACITY'),
+                    error_rate=current_app.config.get('BLACKLIST_BLOOM_ERROR_RATE')
+                )
+            finally:
+                with _bloom_lock:
+                    pending, blacklist_bloom['pending'] = blacklist_bloom['pending'], None
+            with _bloom_lock:
+                for key in pending:
+                    bloom.add(key)
+                blacklist_bloom['filter'] = bloom
+                blacklist_bloom['built_at'] = time.monotonic()
+            return bloom
+        finally:
+            _rebuild_lock.release()
+
+
+# Every inserted token goes into the bloom filter, so it never reports a false negative
+@event.listens_for(BlacklistToken, 'after_insert')
+def add_to_blacklist_bloom(mapper, connection, target):
+    add_to_bloom(target.jti)
+
+
+def add_to_bloom(key):
+    with _bloom_lock:
+        bloom = blacklist_bloom['filter']
+        if bloom is not None:
+            bloom.add(key)
+        if blacklist_bloom['pending'] is not None:
+            blacklist_bloom['pending'].append(key)
+
+
+# Invalidations published by the other workers, applied to this process's caches
+def _on_revoked(message):
+    BlacklistToken.cache_result(message['key'], True, message.get('exp'))
+    add_to_bloom(message['key'])
+
+
+def _on_token_evicted(message):
+    token_cache.pop(message['digest'])
+
+
+def _on_user_changed(message):
+    token_versions.pop(message['id'])
+    user_records.pop(message['id'])
+    if message.get('identity_changed_at'):
+        identity_changes.set(message['id'], message['identity_changed_at'])
+
+
+
+# Refresh token model; only a digest of each opaque token is stored
+class RefreshToken(db.Model):
+    __tablename__ = 'refresh_tokens'
+
+    token_hash = db.Column(db.String(64), primary_key=True)
+    # Every token minted by rotation shares the family of the login that started it
+    family_id = db.Column(db.String(32), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    issued_on = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    used_on = db.Column(db.DateTime, nullable=True)
+    revoked = db.Column(db.Boolean, nullable=False, default=False)
+
+    def __init__(self, token, user_id, family_id=None):
+        now = datetime.datetime.utcnow()
+        self.token_hash = token_digest(token)
+        self.family_id = family_id or uuid.uuid4().hex
+        self.user_id = user_id
+        self.issued_on = now
+        self.expires_at = now + datetime.timedelta(seconds=current_app.config.get('REFRESH_TOKEN_TTL'))
+        self.revoked = False
+
+    def __repr__(self):
+        return '<refresh token: {} family: {}>'.format(self.token_hash, self.family_id)
+
+    @staticmethod
+    # Creates a refresh token for the user and returns the raw token; the caller commits
+    def issue(user_id, family_id=None):
+        token = secrets.token_urlsafe(32)
+        db.session.add(RefreshToken(token, user_id, family_id))
+        return token
+
+    @staticmethod
+    # Exchanges a refresh token for a new one in the same family. Returns the new
+    # token and the user id, or an error message. Presenting a token that was already
+    # exchanged revokes its whole family, since one of the two holders is an attacker.
+    def rotate(token):
+        now = datetime.datetime.utcnow()
+        row = RefreshToken.query.get(token_digest(str(token)))
+        if not row or row.revoked:
+            return "Invalid refresh token. Please log in again."
+        if row.expires_at < now:
+            return "Refresh token expired. Please log in again."
+        # compare-and-set, so two concurrent refreshes cannot both succeed
+        claimed = RefreshToken.query.filter_by(
+            token_hash=row.token_hash, used_on=None
+        ).update({'used_on': now}, synchronize_session=False)
+        if not claimed:
+            RefreshToken.query.filter_by(family_id=row.family_id).update(
+                {'revoked': True}, synchronize_session=False)
+            db.session.commit()
+            return "Refresh token reuse detected. Please log in again."
+        new_token = RefreshToken.issue(row.user_id, row.family_id)
+        db.session.commit()
+        return new_token, row.user_id, row.family_id
+
+    @staticmethod
+    # Revokes every refresh token of a login session; the caller commits
+    def revoke_family(family_id):
+        return RefreshToken.query.filter_by(family_id=family_id, revoked=False).update(
+            {'revoked': True}, synchronize_session=False)
@@ -0,0 +1,100 @@
+# project/server/ratelimit.py
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+from werkzeug.local import LocalProxy
+from werkzeug.utils import import_string
+
+
+# In-process sliding-window counters. Each key keeps only the counts of the current
+# and previous fixed windows; the previous count is weighted by how much of it still
+# overlaps the sliding window. Least recently used keys are evicted past max_keys.
+class MemoryBackend:
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(app.config.get('LOGIN_RATE_LIMIT_MAX_KEYS'))
+
+    # Counts one hit against key; returns 0 if allowed, else seconds until retrying
+    def hit(self, key, limit, window, now=None):
+        if now is None:
+            now = time.time()
+        current = int(now // window)
+        elapsed = now - current * window
+        with self._lock:
+            index, previous, count = self._windows.get(key, (current, 0, 0))
+            if index != current:
+                previous = count if index == current - 1 else 0
+                count = 0
+            estimate = previous * (1 - elapsed / float(window)) + count
+            if estimate >= limit:
+                self._windows[key] = (current, previous, count)
+                self._windows.move_to_end(key)
+                return max(1, int(math.ceil(window - elapsed)))
+            self._windows[key] = (current, previous, count + 1)
+            self._windows.move_to_end(key)
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+        return 0
+
+    def __len__(self):
+        return len(self._windows)
+
+    def clear(self):
+        with self._lock:
+            self._windows.clear()
+
+
+# Applies the per-email and per-IP login limits; a shared backend (any class with the
+# same from_app() and hit() methods) can be plugged in through LOGIN_RATE_LIMIT_BACKEND
+class LoginLimiter:
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    # Returns 0 if the attempt may proceed, else the seconds to wait before retrying
+    def check(self, email, remote_addr):
+        if not current_app.config.get('LOGIN_RATE_LIMIT_ENABLED'):
+            return 0
+        rules = []
+        if email:
+            limit, window = current_app.config.get('LOGIN_RATE_LIMIT_PER_EMAIL')
+            rules.append(('login:email:' + str(email).strip().lower(), limit, window))
+        if remote_addr:
+            limit, window = current_app.config.get('LOGIN_RATE_LIMIT_PER_IP')
+            rules.append(('login:ip:' + remote_addr, limit, window))
+        retry_after = 0
+        for key, limit, window in rules:
+            retry_after = max(retry_after, self.backend.hit(key, limit, window))
+        return retry_after
+
+
+# The address the per-IP limit keys on. Behind LOGIN_RATE_LIMIT_TRUSTED_PROXIES reverse
+# proxies it is that many X-Forwarded-For entries from the right; entries further left
+# are set by the client and never trusted.
+def client_addr():
+    proxies = current_app.config.get('LOGIN_RATE_LIMIT_TRUSTED_PROXIES')
+    if proxies:
+        forwarded = [addr.strip() for addr in request.headers.get('X-Forwarded-For', '').split(',')
+                     if addr.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.remote_addr
+
+
+# The current app's limiter, created by init_app
+limiter = LocalProxy(lambda: current_app.extensions['login_limiter'])
+
+
+# Creates a limiter with the backend configured for the app
+def init_app(app):
+    backend = import_string(app.config.get('LOGIN_RATE_LIMIT_BACKEND')).from_app(app)
+    app.extensions['login_limiter'] = LoginLimiter(backend)
@@ -0,0 +1,219 @@
+# project/server/revocation.py
+import atexit
+import os
+import threading
+import time
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+from werkzeug.utils import import_string
+
+from project.server import db
+
+try:
+    import redis
+except ImportError:  # only needed for RedisStore
+    redis = None
+
+
+# Where revoked token keys live. BlacklistToken keeps its caches in front of the
+# configured store; a store only has to answer whether a key was revoked.
+# expires_at is the token's exp as a unix timestamp, after which the key may be forgotten.
+class RevocationStore:
+
+    @classmethod
+    def from_app(cls, app):
+        return cls()
+
+    def add(self, key, expires_at):
+        raise NotImplementedError
+
+    def contains(self, key):
+        return bool(self.contains_many([key]))
+
+    # Returns the subset of keys that are revoked
+    def contains_many(self, keys):
+        raise NotImplementedError
+
+    # Forgets expired keys; returns how many were removed
+    def prune(self, batch_size=1000):
+        return 0
+
+
+# Write-behind queue for SQLStore: revocations are held in memory, where they take
+# effect at once in this process, and written by one background thread in a single
+# transaction once flush_size are waiting or every interval seconds. Whatever is
+# still queued is flushed at interpreter exit; a crash loses at most one interval.
+class RevocationWriter:
+
+    def __init__(self, app, flush_size=500, interval=0.1):
+        self.app = app
+        self.flush_size = flush_size
+        self.interval = interval
+        self._pending = {}
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        atexit.register(self.flush)
+
+    def add(self, key, expires_at):
+        self._ensure_started()
+        with self._lock:
+            self._pending[key] = expires_at
+            full = len(self._pending) >= self.flush_size
+        if full:
+            self._wakeup.set()
+
+    # The keys that are queued or being written
+    def pending(self, keys):
+        with self._lock:
+            return set(key for key in keys if key in self._pending or key in self._flushing)
+
+    # The thread is started on first use, so each pre-forked worker runs its own
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            thread = threading.Thread(target=self._run, name='revocation-writer')
+            thread.daemon = True
+            thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    # Writes everything queued; a failed batch is queued again. Returns the rows written.
+    def flush(self):
+        from project.server.models import BlacklistToken
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+            if not self._flushing:
+                return 0
+            with self.app.app_context():
+                try:
+                    return BlacklistToken.insert_many(self._flushing)
+                except Exception:
+                    db.session.rollback()
+                    with self._lock:
+                        for key, expires_at in self._flushing.items():
+                            self._pending.setdefault(key, expires_at)
+                    self.app.logger.exception('Revocation flush failed')
+                    return 0
+                finally:
+                    with self._lock:
+                        self._flushing = {}
+                    db.session.remove()
+
+
+# Revocations as blacklist_tokens rows, behind the bloom filter when it is enabled.
+# Each logout commits on its own unless REVOCATION_DURABILITY is 'write_behind'.
+class SQLStore(RevocationStore):
+
+    def __init__(self, writer=None):
+        self.writer = writer
+
+    @classmethod
+    def from_app(cls, app):
+        if app.config.get('REVOCATION_DURABILITY') == 'write_behind':
+            return cls(RevocationWriter(
+                app, app.config.get('REVOCATION_FLUSH_SIZE'), app.config.get('REVOCATION_FLUSH_INTERVAL')))
+        return cls()
+
+    def add(self, key, expires_at):
+        from project.server.models import BlacklistToken
+        if self.writer is not None:
+            self.writer.add(key, expires_at)
+            return
+        db.session.add(BlacklistToken(token=None, payload={'jti': key, 'exp': expires_at}))
+        db.session.commit()
+
+    def contains_many(self, keys):
+        from project.server.models import BlacklistToken
+        found = self.writer.pending(keys) if self.writer is not None else set()
+        keys = [key for key in keys if key not in found and BlacklistToken.might_be_blacklisted(key)]
+        if keys:
+            found.update(row.jti for row in db.session.query(BlacklistToken.jti)
+                         .filter(BlacklistToken.jti.in_(keys)))
+        return found
+
+    def prune(self, batch_size=1000):
+        from project.server.models import BlacklistToken
+        return BlacklistToken.prune_expired(batch_size)
+
+
+# Process-local store for tests and single-process deployments
+class MemoryStore(RevocationStore):
+
+    def __init__(self):
+        self._expiries = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, expires_at):
+        with self._lock:
+            self._expiries[key] = expires_at
+
+    def contains_many(self, keys):
+        now = time.time()
+        with self._lock:
+            return set(key for key in keys
+                       if key in self._expiries and self._expiries[key] > now)
+
+    def prune(self, batch_size=1000):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, expires_at in self._expiries.items() if expires_at <= now]
+            for key in expired:
+                del self._expiries[key]
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._expiries.clear()
+
+
+# Revocations as Redis keys that expire with their token, so nothing needs pruning.
+# Works with any server speaking the Redis protocol; batch checks are one pipeline.
+class RedisStore(RevocationStore):
+
+    def __init__(self, client, prefix='revoked:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_app(cls, app):
+        if redis is None:
+            raise RuntimeError('The redis package is required for the Redis revocation store.')
+        return cls(redis.StrictRedis.from_url(app.config.get('REVOCATION_REDIS_URL')),
+                   app.config.get('REVOCATION_REDIS_PREFIX'))
+
+    def add(self, key, expires_at):
+        ttl = int(expires_at - time.time()) + 1
+        if ttl > 0:
+            self.client.set(self.prefix + key, 1, ex=ttl)
+
+    def contains(self, key):
+        return bool(self.client.exists(self.prefix + key))
+
+    def contains_many(self, keys):
+        keys = list(keys)
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.exists(self.prefix + key)
+        return set(key for key, found in zip(keys, pipeline.execute()) if found)
+
+
+# The current app's store, created by init_app
+store = LocalProxy(lambda: current_app.extensions['revocation_store'])
+
+
+# Builds the store named by REVOCATION_STORE
+def init_app(app):
+    app.extensions['revocation_store'] = import_string(app.config.get('REVOCATION_STORE')).from_app(app)
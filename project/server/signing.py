@@ -0,0 +1,278 @@
+# project/server/signing.py
+import base64
+import binascii
+import calendar
+import datetime
+import glob
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+import jwt
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+except ImportError:  # only needed for RS256/EdDSA
+    serialization = None
+
+ASYMMETRIC_ALGORITHMS = ('RS256', 'EdDSA')
+
+
+def _b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _int_to_b64url(value):
+    return _b64url(value.to_bytes((value.bit_length() + 7) // 8, 'big'))
+
+
+# Public JWK for an RSA or Ed25519 public key
+def public_jwk(kid, public_key):
+    if isinstance(public_key, rsa.RSAPublicKey):
+        numbers = public_key.public_numbers()
+        jwk = {'kty': 'RSA', 'alg': 'RS256', 'n': _int_to_b64url(numbers.n), 'e': _int_to_b64url(numbers.e)}
+    else:
+        raw = public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        jwk = {'kty': 'OKP', 'alg': 'EdDSA', 'crv': 'Ed25519', 'x': _b64url(raw)}
+    jwk['kid'] = kid
+    jwk['use'] = 'sig'
+    return jwk
+
+
+# Writes a new private key named after its kid into key_dir and returns the kid
+def generate_key(key_dir, algorithm='RS256'):
+    if serialization is None:
+        raise RuntimeError('The cryptography package is required for {} keys.'.format(algorithm))
+    if algorithm == 'EdDSA':
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    else:
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    if not os.path.isdir(key_dir):
+        os.makedirs(key_dir)
+    # kids sort by creation time, so the newest key is the active one
+    kid = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+    path = os.path.join(key_dir, kid + '.pem')
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(pem)
+    return kid
+
+
+# kid-indexed cache of parsed keys, loaded from the PEM files in JWT_KEY_DIR. A new
+# key is published on /auth/jwks at once but only signs tokens after activation_delay
+# seconds, so verifiers holding a cached JWKS already know it by then.
+class KeyRing:
+
+    def __init__(self, key_dir, refresh=60, activation_delay=0, miss_cooldown=1):
+        self.key_dir = key_dir
+        self.refresh = refresh
+        self.activation_delay = activation_delay
+        self.miss_cooldown = miss_cooldown
+        self.private_keys = {}
+        self.public_keys = {}
+        self.active_kid = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    # Parses new keys once and forgets keys whose file was removed, e.g. by rotate_keys.
+    # With max_age, a load done by another thread within that many seconds is kept.
+    def load(self, max_age=None):
+        if serialization is None:
+            raise RuntimeError('The cryptography package is required for asymmetric signing.')
+        with self._lock:
+            if max_age is not None and self._loaded_at is not None \
+                    and time.monotonic() - self._loaded_at <= max_age:
+                return
+            created = {}
+            for path in glob.glob(os.path.join(self.key_dir, '*.pem')):
+                kid = os.path.splitext(os.path.basename(path))[0]
+                try:
+                    created[kid] = os.path.getmtime(path)
+                    if kid not in self.private_keys:
+                        with open(path, 'rb') as f:
+                            private_key = serialization.load_pem_private_key(f.read(), None, default_backend())
+                        self.private_keys[kid] = private_key
+                        self.public_keys[kid] = private_key.public_key()
+                except (IOError, OSError):
+                    # removed between listing and reading
+                    created.pop(kid, None)
+            for kid in list(self.private_keys):
+                if kid not in created:
+                    del self.private_keys[kid]
+                    del self.public_keys[kid]
+            self.active_kid = self._choose_active(created)
+            self._loaded_at = time.monotonic()
+
+    # JWT_ACTIVE_KID if present, else the newest key past its activation delay. When
+    # no key is old enough yet (a first deployment) the newest key is used anyway.
+    def _choose_active(self, created):
+        if not created:
+            return None
+        configured = current_app.config.get('JWT_ACTIVE_KID')
+        if configured in created:
+            return configured
+        now = time.time()
+        ready = [kid for kid, mtime in created.items() if now - mtime >= self.activation_delay]
+        return max(ready or created)
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh:
+            self.load(self.refresh)
+
+    def signing_key(self):
+        self._ensure_loaded()
+        if self.active_kid is None:
+            raise RuntimeError('No signing keys in {}. Run "manage.py rotate_keys".'.format(self.key_dir))
+        return self.active_kid, self.private_keys[self.active_kid]
+
+    # Keys minted by another process after our last load are picked up on first sight.
+    # The kid comes from an unverified header, so unknown kids rescan the key directory
+    # at most once per miss_cooldown seconds and tokens without one are refused outright.
+    def verification_key(self, kid):
+        if not isinstance(kid, str):
+            raise jwt.InvalidTokenError('Missing key id')
+        self._ensure_loaded()
+        if kid not in self.public_keys:
+            self.load(self.miss_cooldown)
+        if kid not in self.public_keys:
+            raise jwt.InvalidTokenError('Unknown key id')
+        return self.public_keys[kid]
+
+    def jwks(self):
+        self._ensure_loaded()
+        return {'keys': [public_jwk(kid, key) for kid, key in sorted(self.public_keys.items())]}
+
+    def clear(self):
+        with self._lock:
+            self.private_keys.clear()
+            self.public_keys.clear()
+            self.active_kid = None
+            self._loaded_at = None
+
+
+# The current app's keyring, created by init_app
+keyring = LocalProxy(lambda: current_app.extensions['signing_keyring'])
+
+
+# Creates a keyring for the app's key directory; keys are read on first use
+def init_app(app):
+    app.extensions['signing_keyring'] = KeyRing(
+        app.config.get('JWT_KEY_DIR'),
+        refresh=app.config.get('JWT_KEY_REFRESH'),
+        activation_delay=app.config.get('JWT_KEY_ACTIVATION_DELAY'),
+        miss_cooldown=app.config.get('JWT_KEY_MISS_COOLDOWN')
+    )
+
+
+def _b64url_decode(segment):
+    segment = segment + b'=' * (-len(segment) % 4)
+    return base64.urlsafe_b64decode(segment)
+
+
+# HS256 tokens on a short path: the HMAC key is prepared once, the header segment is
+# computed once (by PyJWT itself, so tokens stay byte-for-byte identical to its output)
+# and decoding only validates the claims this app issues. Tokens with a different
+# header, or with nbf/aud/iss claims, are handed to PyJWT unchanged.
+class HS256Engine:
+
+    TIME_CLAIMS = ('exp', 'iat', 'nbf')
+    FALLBACK_CLAIMS = ('nbf', 'aud', 'iss')
+
+    def __init__(self, secret):
+        self.secret = secret
+        key = secret.encode('utf-8') if not isinstance(secret, bytes) else secret
+        self._mac = hmac.new(key, digestmod=hashlib.sha256)
+        sample = jwt.encode({}, secret, algorithm='HS256')
+        # PyJWT 1.x returns bytes and 2.x returns str; callers get the same type
+        self._returns_bytes = isinstance(sample, bytes)
+        if not self._returns_bytes:
+            sample = sample.encode('ascii')
+        self._header = sample.split(b'.')[0]
+
+    def _sign(self, signing_input):
+        mac = self._mac.copy()
+        mac.update(signing_input)
+        return mac.digest()
+
+    def encode(self, payload):
+        payload = dict(payload)
+        for claim in self.TIME_CLAIMS:
+            if isinstance(payload.get(claim), datetime.datetime):
+                payload[claim] = calendar.timegm(payload[claim].utctimetuple())
+        body = _b64url(json.dumps(payload, separators=(',', ':')).encode('utf-8')).encode('ascii')
+        signing_input = self._header + b'.' + body
+        token = signing_input + b'.' + _b64url(self._sign(signing_input)).encode('ascii')
+        return token if self._returns_bytes else token.decode('ascii')
+
+    def decode(self, auth_token):
+        if not isinstance(auth_token, bytes):
+            auth_token = str(auth_token).encode('utf-8')
+        parts = auth_token.split(b'.')
+        if len(parts) != 3:
+            raise jwt.DecodeError('Not enough segments')
+        if parts[0] != self._header:
+            return jwt.decode(auth_token, self.secret, algorithms=['HS256'])
+        try:
+            signature = _b64url_decode(parts[2])
+            payload = json.loads(_b64url_decode(parts[1]).decode('utf-8'))
+        except (binascii.Error, TypeError, ValueError):
+            raise jwt.DecodeError('Invalid token encoding')
+        if not hmac.compare_digest(signature, self._sign(parts[0] + b'.' + parts[1])):
+            raise jwt.InvalidSignatureError('Signature verification failed')
+        if not isinstance(payload, dict):
+            raise jwt.DecodeError('Invalid payload string: must be a json object')
+        if any(claim in payload for claim in self.FALLBACK_CLAIMS):
+            return jwt.decode(auth_token, self.secret, algorithms=['HS256'])
+        if 'iat' in payload and not isinstance(payload['iat'], int):
+            raise jwt.InvalidIssuedAtError('Issued At claim (iat) must be an integer.')
+        if 'exp' in payload:
+            if not isinstance(payload['exp'], int):
+                raise jwt.DecodeError('Expiration Time claim (exp) must be an integer.')
+            if payload['exp'] < calendar.timegm(datetime.datetime.utcnow().utctimetuple()):
+                raise jwt.ExpiredSignatureError('Signature has expired')
+        return payload
+
+
+_engines = {}
+
+
+# One engine per secret, so the key is only prepared again when SECRET_KEY changes
+def hs256_engine(secret):
+    engine = _engines.get(secret)
+    if engine is None:
+        engine = _engines.setdefault(secret, HS256Engine(secret))
+    return engine
+
+
+# Signs a payload with the configured algorithm; asymmetric tokens carry a kid header
+def encode(payload):
+    algorithm = current_app.config.get('JWT_ALGORITHM')
+    if algorithm not in ASYMMETRIC_ALGORITHMS:
+        if current_app.config.get('JWT_FAST_HS256'):
+            return hs256_engine(current_app.config.get('SECRET_KEY')).encode(payload)
+        return jwt.encode(payload, current_app.config.get('SECRET_KEY'), algorithm='HS256')
+    kid, key = keyring.signing_key()
+    return jwt.encode(payload, key, algorithm=algorithm, headers={'kid': kid})
+
+
+# Verifies a token signed with the configured algorithm and returns its payload
+def decode(auth_token):
+    algorithm = current_app.config.get('JWT_ALGORITHM')
+    if algorithm not in ASYMMETRIC_ALGORITHMS:
+        if current_app.config.get('JWT_FAST_HS256'):
+            return hs256_engine(current_app.config.get('SECRET_KEY')).decode(auth_token)
+        return jwt.decode(auth_token, current_app.config.get('SECRET_KEY'), algorithms=['HS256'])
+    kid = jwt.get_unverified_header(auth_token).get('kid')
+    return jwt.decode(auth_token, keyring.verification_key(kid), algorithms=[algorithm])
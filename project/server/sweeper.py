@@ -0,0 +1,43 @@
+# project/server/sweeper.py
+import threading
+import time
+
+from flask import current_app
+
+from project.server import db, revocation
+
+
+# Prunes expired revocations from the store, returning how many were removed and how long it took
+def prune_blacklist(batch_size=None):
+    if batch_size is None:
+        batch_size = current_app.config.get('BLACKLIST_PRUNE_BATCH_SIZE')
+    start = time.time()
+    removed = revocation.store.prune(batch_size)
+    return removed, time.time() - start
+
+
+# Background thread that prunes the blacklist every BLACKLIST_SWEEP_INTERVAL seconds
+class BlacklistSweeper(threading.Thread):
+
+    def __init__(self, app, interval=None):
+        super(BlacklistSweeper, self).__init__(name='blacklist-sweeper')
+        self.daemon = True
+        self.app = app
+        self.interval = interval or app.config.get('BLACKLIST_SWEEP_INTERVAL')
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    removed, elapsed = prune_blacklist()
+                    self.app.logger.info(
+                        'Pruned %d expired blacklist tokens in %.3fs', removed, elapsed)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Blacklist sweep failed')
+                finally:
+                    db.session.remove()
+
+    def stop(self):
+        self._stopped.set()
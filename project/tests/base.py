@@ -2,21 +2,82 @@
 
 
 from flask_testing import TestCase
+from sqlalchemy import event
 
-from project.server import app, db
+from project.server import create_app, db
+from project.server.models import (
+    blacklist_bloom, blacklist_cache, identity_changes, token_cache, token_versions, user_records
+)
+from project.server.ratelimit import limiter
+
+
+app = create_app('project.server.config.TestingConfig')
+
+# The schema is created once per run; every test then runs in a transaction that
+# is rolled back, so nothing needs to be dropped or recreated between tests
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+
+# Runs a test against a real, committing session instead of inside the rolled-back
+# transaction, for tests whose threads need database connections of their own
+def without_transaction(test):
+    test.transactional = False
+    return test
 
 
 class BaseTestCase(TestCase):
     """ Base Tests """
 
     def create_app(self):
+        # tests may change settings, so every test starts from a fresh TestingConfig
         app.config.from_object('project.server.config.TestingConfig')
         return app
 
     def setUp(self):
-        db.create_all()
-        db.session.commit()
+        self.transactional = getattr(getattr(self, self._testMethodName), 'transactional', True)
+        if self.transactional:
+            self._begin_test_transaction()
+        blacklist_cache.clear()
+        token_cache.clear()
+        identity_changes.clear()
+        token_versions.clear()
+        user_records.clear()
+        limiter.backend.clear()
+        blacklist_bloom['filter'] = None
 
     def tearDown(self):
         db.session.remove()
-        db.drop_all()
+        if self.transactional:
+            self._transaction.rollback()
+            if self._connection.dialect.name == 'sqlite':
+                self._connection.connection.isolation_level = ''
+            self._connection.close()
+            db.session = self._session
+        else:
+            for table in reversed(db.metadata.sorted_tables):
+                db.session.execute(table.delete())
+            db.session.commit()
+            db.session.remove()
+
+    # Binds db.session to one connection inside an outer transaction and a
+    # savepoint; commits by the code under test only release the savepoint,
+    # after which a new one is started
+    def _begin_test_transaction(self):
+        self._connection = db.engine.connect()
+        self._transaction = self._connection.begin()
+        if self._connection.dialect.name == 'sqlite':
+            # pysqlite does not emit BEGIN itself and would commit on SAVEPOINT,
+            # so the transaction is managed by hand on this connection only
+            self._connection.connection.isolation_level = None
+            self._connection.execute('BEGIN')
+        self._session = db.session
+        db.session = db.create_scoped_session(options={'bind': self._connection, 'binds': {}})
+        db.session.begin_nested()
+
+        @event.listens_for(db.session, 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            if transaction.nested and not transaction._parent.nested:
+                session.expire_all()
+                session.begin_nested()
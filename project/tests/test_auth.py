@@ -1,10 +1,17 @@
 # project/tests/test_auth.py
 import unittest
 import json
+import os
+import shutil
+import tempfile
+import threading
 import time
-from project.server import db
-from project.server.models import User, BlacklistToken
-from project.tests.base import BaseTestCase
+import jwt
+from sqlalchemy.exc import IntegrityError
+
+from project.server import db, hashing, importer, revocation, signing
+from project.server.models import User, BlacklistToken, blacklist_cache, identity_changes
+from project.tests.base import BaseTestCase, without_transaction
 
 # Simulates a registered user
 def register_user(self, email, password):
@@ -36,13 +43,136 @@ class TestAuthBlueprint(BaseTestCase):
         db.session.commit()
 
         with self.client:
-            response = register_user(self, "joe@gmail.com", "123456")
+            generate_password_hash = hashing.generate_password_hash
+            hashing.generate_password_hash = None
+            try:
+                # an existing email is answered without hashing the password
+                response = register_user(self, "joe@gmail.com", "123456")
+            finally:
+                hashing.generate_password_hash = generate_password_hash
             data = json.loads(response.data.decode())
             self.assertTrue(data['status'] == 'fail')
             self.assertTrue(data['message'] == 'User already exists. Please Log in.')
             self.assertTrue(response.content_type == 'application/json')
             self.assertEqual(response.status_code, 202)
 
+    # Tests that an admin can register users in bulk, with duplicates reported
+    def test_bulk_registration(self):
+        admin = User(email = 'admin@gmail.com', password = 'admin', admin = True)
+        db.session.add(admin)
+        db.session.commit()
+        auth_token = admin.encode_auth_token(admin.id).decode()
+        body = '\n'.join([
+            json.dumps(dict(email = 'joe@gmail.com', password = '123456')),
+            json.dumps(dict(email = 'ann@gmail.com', password = '123456', admin = True)),
+            json.dumps(dict(email = 'joe@gmail.com', password = '654321')),
+            json.dumps(dict(email = 'admin@gmail.com', password = '123456')),
+            json.dumps(dict(email = 'bob@gmail.com'))
+        ])
+        with self.client:
+            response = self.client.post(
+                '/auth/register/bulk',
+                data = body,
+                content_type = 'application/x-ndjson',
+                headers = dict(Authorization='Bearer ' + auth_token)
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'success')
+            self.assertEqual(data['imported'], 2)
+            self.assertEqual(sorted(data['duplicates']), ['admin@gmail.com', 'joe@gmail.com'])
+            self.assertEqual(data['invalid'], 1)
+            self.assertEqual(response.status_code, 201)
+            self.assertTrue(User.query.filter_by(email = 'ann@gmail.com').first().admin)
+
+    # Tests that rows which are not objects are refused, and rows with non-string fields counted invalid
+    def test_bulk_registration_malformed_rows(self):
+        admin = User(email = 'admin@gmail.com', password = 'admin', admin = True)
+        db.session.add(admin)
+        db.session.commit()
+        headers = dict(Authorization='Bearer ' + admin.encode_auth_token(admin.id).decode())
+        with self.client:
+            for row in ('[1]', '"x"'):
+                response = self.client.post(
+                    '/auth/register/bulk',
+                    data = row,
+                    content_type = 'application/x-ndjson',
+                    headers = headers
+                )
+                data = json.loads(response.data.decode())
+                self.assertTrue(data['message'] == 'Malformed user records.')
+                self.assertEqual(response.status_code, 400)
+            response = self.client.post(
+                '/auth/register/bulk',
+                data = '\n'.join([
+                    json.dumps(dict(email = ['joe@gmail.com'], password = '123456')),
+                    json.dumps(dict(email = 'ann@gmail.com', password = 123456))
+                ]),
+                content_type = 'application/x-ndjson',
+                headers = headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['imported'], 0)
+            self.assertEqual(data['invalid'], 2)
+            self.assertEqual(response.status_code, 201)
+
+    # Tests that an import losing to concurrent registrations twice answers with a JSON 409
+    def test_bulk_registration_conflict(self):
+        admin = User(email = 'admin@gmail.com', password = 'admin', admin = True)
+        db.session.add(admin)
+        db.session.commit()
+        def conflict(records):
+            raise IntegrityError('INSERT', {}, Exception('duplicate key'))
+        import_users = importer.import_users
+        importer.import_users = conflict
+        try:
+            with self.client:
+                response = self.client.post(
+                    '/auth/register/bulk',
+                    data = json.dumps(dict(email = 'joe@gmail.com', password = '123456')),
+                    content_type = 'application/x-ndjson',
+                    headers = dict(Authorization='Bearer ' + admin.encode_auth_token(admin.id).decode())
+                )
+                data = json.loads(response.data.decode())
+                self.assertTrue(data['status'] == 'fail')
+                self.assertEqual(response.status_code, 409)
+        finally:
+            importer.import_users = import_users
+
+    # Tests that bulk registration is refused to non-admin users
+    def test_bulk_registration_requires_admin(self):
+        with self.client:
+            resp_register = register_user(self, "joe@gmail.com", "123456")
+            response = self.client.post(
+                '/auth/register/bulk',
+                data = 'email,password\nann@gmail.com,123456\n',
+                content_type = 'text/csv',
+                headers = dict(Authorization='Bearer ' + json.loads(resp_register.data.decode())['auth_token'])
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['message'] == 'Admin privileges required.')
+            self.assertEqual(response.status_code, 403)
+
+    # Tests that concurrent signups with one email create exactly one user
+    @without_transaction
+    def test_concurrent_registration(self):
+        statuses = []
+
+        def register():
+            response = self.app.test_client().post(
+                "/auth/register",
+                data = json.dumps(dict(email = "joe@gmail.com", password = "123456")),
+                content_type = "application/json"
+            )
+            statuses.append(response.status_code)
+
+        threads = [threading.Thread(target = register) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(statuses), [201] + [202] * 7)
+        self.assertEqual(User.query.filter_by(email = 'joe@gmail.com').count(), 1)
+
     # Tests the login of registered users
     def test_registered_user_login(self):
         with self.client:
@@ -71,6 +201,150 @@ class TestAuthBlueprint(BaseTestCase):
             self.assertEqual(response.status_code, 200)
 
 
+    # Tests exchanging a refresh token, and family revocation when one is reused
+    def test_refresh_token_rotation_and_reuse(self):
+        with self.client:
+            register_user(self, "joe@gmail.com", "123456")
+            resp_login = self.client.post(
+                '/auth/login',
+                data = json.dumps(dict(email = 'joe@gmail.com', password = '123456')),
+                content_type='application/json'
+            )
+            refresh_token = json.loads(resp_login.data.decode())['refresh_token']
+            self.assertTrue(refresh_token)
+
+            response = self.client.post(
+                '/auth/refresh',
+                data = json.dumps(dict(refresh_token = refresh_token)),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'success')
+            self.assertTrue(data['message'] == 'Successfully refreshed.')
+            self.assertTrue(User.decode_auth_token(data['auth_token']) == 1)
+            self.assertNotEqual(data['refresh_token'], refresh_token)
+            self.assertEqual(response.status_code, 200)
+            rotated_token = data['refresh_token']
+
+            # presenting the exchanged token again revokes the whole family
+            response = self.client.post(
+                '/auth/refresh',
+                data = json.dumps(dict(refresh_token = refresh_token)),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['message'] == 'Refresh token reuse detected. Please log in again.')
+            self.assertEqual(response.status_code, 401)
+            response = self.client.post(
+                '/auth/refresh',
+                data = json.dumps(dict(refresh_token = rotated_token)),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['message'] == 'Invalid refresh token. Please log in again.')
+            self.assertEqual(response.status_code, 401)
+
+    # Tests that logging out also revokes the session's refresh tokens
+    def test_refresh_after_logout(self):
+        with self.client:
+            register_user(self, "joe@gmail.com", "123456")
+            resp_login = self.client.post(
+                '/auth/login',
+                data = json.dumps(dict(email = 'joe@gmail.com', password = '123456')),
+                content_type='application/json'
+            )
+            data = json.loads(resp_login.data.decode())
+            # an access token minted by a refresh still ends the same session
+            response = self.client.post(
+                '/auth/refresh',
+                data = json.dumps(dict(refresh_token = data['refresh_token'])),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            response = self.client.post(
+                '/auth/logout',
+                headers = dict(Authorization='Bearer ' + data['auth_token'])
+            )
+            self.assertEqual(response.status_code, 200)
+            response = self.client.post(
+                '/auth/refresh',
+                data = json.dumps(dict(refresh_token = data['refresh_token'])),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['message'] == 'Invalid refresh token. Please log in again.')
+            self.assertEqual(response.status_code, 401)
+
+    # Tests that repeated login attempts for one email are throttled with a 429
+    def test_login_rate_limited(self):
+        with self.client:
+            for _ in range(5):
+                self.client.post(
+                    '/auth/login',
+                    data = json.dumps(dict(email = 'joe@gmail.com', password = 'wrong')),
+                    content_type='application/json'
+                )
+            response = self.client.post(
+                '/auth/login',
+                data = json.dumps(dict(email = 'joe@gmail.com', password = 'wrong')),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['message'] == 'Too many login attempts. Please try again later.')
+            self.assertTrue(int(response.headers['Retry-After']) > 0)
+            self.assertEqual(response.status_code, 429)
+
+    # Tests that a JSON null login body is answered like one without credentials
+    def test_login_null_body(self):
+        with self.client:
+            response = self.client.post(
+                '/auth/login',
+                data = 'null',
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'fail')
+            self.assertEqual(response.status_code, 404)
+
+    # Tests that a login body which is not a JSON object is refused before throttling
+    def test_login_non_object_body(self):
+        with self.client:
+            response = self.client.post(
+                '/auth/login',
+                data = '["joe@gmail.com"]',
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['message'] == 'Expected a JSON object.')
+            self.assertEqual(response.status_code, 400)
+
+    # Tests that behind a trusted proxy the per-IP limit keys on the forwarded client
+    def test_login_rate_limited_behind_proxy(self):
+        self.app.config['LOGIN_RATE_LIMIT_PER_IP'] = (2, 60)
+        self.app.config['LOGIN_RATE_LIMIT_TRUSTED_PROXIES'] = 1
+        with self.client:
+            for i in range(2):
+                self.client.post(
+                    '/auth/login',
+                    data = json.dumps(dict(email = 'joe{}@gmail.com'.format(i), password = 'wrong')),
+                    content_type='application/json',
+                    headers = {'X-Forwarded-For': 'spoofed-{}, 10.0.0.1'.format(i)}
+                )
+            response = self.client.post(
+                '/auth/login',
+                data = json.dumps(dict(email = 'joe@gmail.com', password = 'wrong')),
+                content_type='application/json',
+                headers = {'X-Forwarded-For': '10.0.0.1'}
+            )
+            self.assertEqual(response.status_code, 429)
+            response = self.client.post(
+                '/auth/login',
+                data = json.dumps(dict(email = 'joe@gmail.com', password = 'wrong')),
+                content_type='application/json',
+                headers = {'X-Forwarded-For': '10.0.0.2'}
+            )
+            self.assertEqual(response.status_code, 404)
+
     # Tests the scenario where a non-registered user attempts to login into the app
     def test_non_registered_user_login(self):
         with self.client:
@@ -86,6 +360,48 @@ class TestAuthBlueprint(BaseTestCase):
             self.assertTrue(response.content_type == 'application/json')
             self.assertEqual(response.status_code, 404)
     
+    # Tests that logins are shed with a 503 when the hashing pool is saturated
+    def test_login_with_saturated_hashing_pool(self):
+        with self.client:
+            register_user(self, "joe@gmail.com", "123456")
+            pool = hashing.pool
+            hashing.pool = hashing.HashingPool(workers = 1, queue_depth = 0)
+            # take the only slot so the login cannot be queued
+            hashing.pool._slots.acquire()
+            try:
+                response = self.client.post(
+                    '/auth/login',
+                    data = json.dumps(dict(email = 'joe@gmail.com', password = '123456')),
+                    content_type='application/json'
+                )
+            finally:
+                hashing.pool = pool
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'fail')
+            self.assertTrue(data['message'] == 'Server is busy. Please try again.')
+            self.assertEqual(response.headers['Retry-After'], '1')
+            self.assertEqual(response.status_code, 503)
+
+    # Tests that hot-path timings are exported in the Prometheus format
+    def test_metrics_endpoint(self):
+        with self.client:
+            register_user(self, "joe@gmail.com", "123456")
+            response = self.client.get('/metrics')
+            body = response.data.decode()
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.content_type.startswith('text/plain'))
+            self.assertIn('flask_jwt_auth_operation_seconds_count{operation="bcrypt_hash"}', body)
+            self.assertIn('flask_jwt_auth_operation_seconds_bucket{operation="jwt_encode",le="+Inf"}', body)
+            self.assertIn('flask_jwt_auth_operation_seconds_count{operation="sql_insert"}', body)
+            self.assertIn('flask_jwt_auth_cache_hits{cache="blacklist"}', body)
+
+    # Tests the optional Server-Timing header
+    def test_server_timing_header(self):
+        self.app.config['METRICS_SERVER_TIMING'] = True
+        with self.client:
+            response = register_user(self, "joe@gmail.com", "123456")
+            self.assertIn('bcrypt_hash;dur=', response.headers['Server-Timing'])
+
     #  Testing if the the auth token is sent with the request within the header.
     def test_user_status(self):
         with self.client:
@@ -103,6 +419,173 @@ class TestAuthBlueprint(BaseTestCase):
             self.assertTrue(data['data']['admin'] is 'true' or 'false')
             self.assertEqual(response.status_code, 200)
 
+    # Tests that identity claims let the status endpoint answer without the users table
+    def test_user_status_from_identity_claims(self):
+        self.app.config['TOKEN_IDENTITY_CLAIMS'] = True
+        with self.client:
+            resp_register = register_user(self, "joe@gmail.com", "123456")
+            auth_token = json.loads(resp_register.data.decode())['auth_token']
+            user = User.query.filter_by(email = 'joe@gmail.com').first()
+            registered_on = user.registered_on
+            # the row is gone, so a successful response must come from the token
+            db.session.delete(user)
+            db.session.commit()
+            response = self.client.get(
+                '/auth/status',
+                headers = dict(Authorization='Bearer ' + auth_token)
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'success')
+            self.assertTrue(data['data']['email'] == 'joe@gmail.com')
+            self.assertTrue(data['data']['admin'] is False)
+            self.assertTrue(data['data']['registered_on'] == registered_on.strftime('%a, %d %b %Y %H:%M:%S GMT'))
+            self.assertEqual(response.status_code, 200)
+
+    # Tests that identity claims are rejected once the user's admin flag changes
+    def test_user_status_after_identity_change(self):
+        self.app.config['TOKEN_IDENTITY_CLAIMS'] = True
+        with self.client:
+            resp_register = register_user(self, "joe@gmail.com", "123456")
+            auth_token = json.loads(resp_register.data.decode())['auth_token']
+            user = User.query.filter_by(email = 'joe@gmail.com').first()
+            user.admin = True
+            db.session.commit()
+            response = self.client.get(
+                '/auth/status',
+                headers = dict(Authorization='Bearer ' + auth_token)
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'fail')
+            self.assertTrue(data['message'] == 'User details changed. Please log in again.')
+            self.assertEqual(response.status_code, 401)
+
+    # Tests that a token issued right after an identity change, in the same second, is accepted
+    def test_user_status_issued_after_identity_change(self):
+        self.app.config['TOKEN_IDENTITY_CLAIMS'] = True
+        with self.client:
+            register_user(self, "joe@gmail.com", "123456")
+            user = User.query.filter_by(email = 'joe@gmail.com').first()
+            user.admin = True
+            db.session.commit()
+            auth_token = user.encode_auth_token(user.id).decode()
+            response = self.client.get(
+                '/auth/status',
+                headers = dict(Authorization='Bearer ' + auth_token)
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'success')
+            self.assertTrue(data['data']['admin'] is True)
+            self.assertEqual(response.status_code, 200)
+
+    # Tests that an identity change that is rolled back does not reject tokens
+    def test_user_status_after_rolled_back_identity_change(self):
+        self.app.config['TOKEN_IDENTITY_CLAIMS'] = True
+        with self.client:
+            resp_register = register_user(self, "joe@gmail.com", "123456")
+            auth_token = json.loads(resp_register.data.decode())['auth_token']
+            user = User.query.filter_by(email = 'joe@gmail.com').first()
+            user.admin = True
+            db.session.flush()
+            db.session.rollback()
+            self.assertIsNone(identity_changes.get(user.id))
+            response = self.client.get(
+                '/auth/status',
+                headers = dict(Authorization='Bearer ' + auth_token)
+            )
+            self.assertEqual(response.status_code, 200)
+
+    # Tests RS256 tokens with a kid header that verifies against the JWKS endpoint
+    @unittest.skipIf(signing.serialization is None, 'cryptography is not installed')
+    def test_rs256_tokens_and_jwks(self):
+        key_dir = tempfile.mkdtemp()
+        keyring = signing.keyring
+        signing.keyring = signing.KeyRing(key_dir)
+        self.app.config['JWT_ALGORITHM'] = 'RS256'
+        try:
+            kid = signing.generate_key(key_dir, 'RS256')
+            with self.client:
+                resp_register = register_user(self, "joe@gmail.com", "123456")
+                auth_token = json.loads(resp_register.data.decode())['auth_token']
+                self.assertEqual(jwt.get_unverified_header(auth_token)['kid'], kid)
+                response = self.client.get(
+                    '/auth/status',
+                    headers = dict(Authorization='Bearer ' + auth_token)
+                )
+                self.assertEqual(response.status_code, 200)
+                response = self.client.get('/auth/jwks')
+                keys = json.loads(response.data.decode())['keys']
+                self.assertEqual([key['kid'] for key in keys], [kid])
+                self.assertEqual(keys[0]['kty'], 'RSA')
+        finally:
+            signing.keyring = keyring
+            shutil.rmtree(key_dir)
+
+    # Tests that a new key is published before it signs, and removed keys are forgotten
+    def test_key_activation_and_removal(self):
+        key_dir = tempfile.mkdtemp()
+        keyring = signing.KeyRing(key_dir, activation_delay = 300)
+        try:
+            old_kid = signing.generate_key(key_dir, 'EdDSA')
+            old_path = os.path.join(key_dir, old_kid + '.pem')
+            os.utime(old_path, (time.time() - 600, time.time() - 600))
+            new_kid = signing.generate_key(key_dir, 'EdDSA')
+            keyring.load()
+            self.assertEqual(keyring.active_kid, old_kid)
+            self.assertEqual([key['kid'] for key in keyring.jwks()['keys']], [old_kid, new_kid])
+            os.remove(old_path)
+            keyring.load()
+            self.assertEqual(keyring.active_kid, new_kid)
+            self.assertEqual([key['kid'] for key in keyring.jwks()['keys']], [new_kid])
+            with self.assertRaises(jwt.InvalidTokenError):
+                keyring.verification_key(old_kid)
+        finally:
+            shutil.rmtree(key_dir)
+
+    # Tests that unknown or missing kids rescan the key directory at most once per cooldown
+    @unittest.skipIf(signing.serialization is None, 'cryptography is not installed')
+    def test_unknown_kid_reload_cooldown(self):
+        key_dir = tempfile.mkdtemp()
+        keyring = signing.KeyRing(key_dir, miss_cooldown = 60)
+        try:
+            signing.generate_key(key_dir, 'EdDSA')
+            keyring.load()
+            loaded_at = keyring._loaded_at
+            for kid in ('forged', None):
+                with self.assertRaises(jwt.InvalidTokenError):
+                    keyring.verification_key(kid)
+            new_kid = signing.generate_key(key_dir, 'EdDSA')
+            with self.assertRaises(jwt.InvalidTokenError):
+                keyring.verification_key(new_kid)
+            self.assertEqual(keyring._loaded_at, loaded_at)
+            keyring.miss_cooldown = 0
+            self.assertTrue(keyring.verification_key(new_kid))
+        finally:
+            shutil.rmtree(key_dir)
+
+    # Tests introspecting valid, blacklisted and malformed tokens in one request
+    def test_introspect_tokens(self):
+        with self.client:
+            resp_register = register_user(self, "joe@gmail.com", "123456")
+            valid_token = json.loads(resp_register.data.decode())['auth_token']
+            user = User.query.filter_by(email = 'joe@gmail.com').first()
+            revoked_token = user.encode_auth_token(user.id).decode()
+            db.session.add(BlacklistToken(token = revoked_token))
+            db.session.commit()
+            response = self.client.post(
+                '/auth/introspect',
+                data = json.dumps(dict(tokens = [valid_token, revoked_token, 'not-a-token'])),
+                content_type = 'application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'success')
+            self.assertTrue(data['results'][0]['active'])
+            self.assertTrue(data['results'][0]['email'] == 'joe@gmail.com')
+            self.assertFalse(data['results'][1]['active'])
+            self.assertTrue(data['results'][1]['message'] == 'Token blacklisted. Please log in again.')
+            self.assertFalse(data['results'][2]['active'])
+            self.assertTrue(data['results'][2]['message'] == 'Invalid token. Please log in again.')
+            self.assertEqual(response.status_code, 200)
+
     # Tests logging out before token expiration
     def test_valid_logout(self):
         with self.client:
@@ -246,6 +729,92 @@ class TestAuthBlueprint(BaseTestCase):
             self.assertTrue(data['message'] == 'Token blacklisted. Please log in again.')
             self.assertEqual(response.status_code, 401)
 
+    # Tests that a logout is visible to status checks through the blacklist cache
+    def test_logout_updates_blacklist_cache(self):
+        with self.client:
+            resp_register = register_user(self, 'joe@gmail.com', '123456')
+            auth_token = json.loads(resp_register.data.decode())['auth_token']
+            self.client.post(
+                '/auth/logout',
+                headers = dict(Authorization='Bearer ' + auth_token)
+            )
+            hits = blacklist_cache.hits
+            response = self.client.get(
+                '/auth/status',
+                headers = dict(Authorization='Bearer ' + auth_token)
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['message'] == 'Token blacklisted. Please log in again.')
+            self.assertEqual(blacklist_cache.hits, hits + 1)
+            self.assertEqual(response.status_code, 401)
+
+    # Tests that a failing revocation store is reported as a JSON server error
+    def test_logout_store_failure(self):
+        class BrokenStore(revocation.MemoryStore):
+            def add(self, key, expires_at):
+                raise RuntimeError('store unavailable')
+        store = revocation.store
+        revocation.store = BrokenStore()
+        try:
+            with self.client:
+                resp_register = register_user(self, 'joe@gmail.com', '123456')
+                auth_token = json.loads(resp_register.data.decode())['auth_token']
+                response = self.client.post(
+                    '/auth/logout',
+                    headers = dict(Authorization='Bearer ' + auth_token)
+                )
+                data = json.loads(response.data.decode())
+                self.assertTrue(data['status'] == 'fail')
+                self.assertTrue(data['message'] == 'Some error occurred. Please try again.')
+                self.assertEqual(response.status_code, 500)
+        finally:
+            revocation.store = store
+
+    # Tests that logging out everywhere revokes every token of the user
+    def test_logout_all(self):
+        with self.client:
+            register_user(self, 'joe@gmail.com', '123456')
+            logins = [json.loads(self.client.post(
+                '/auth/login',
+                data = json.dumps(dict(email = 'joe@gmail.com', password = '123456')),
+                content_type = 'application/json'
+            ).data.decode()) for _ in range(2)]
+            response = self.client.post(
+                '/auth/logout_all',
+                headers = dict(Authorization='Bearer ' + logins[0]['auth_token'])
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'success')
+            self.assertTrue(data['message'] == 'Successfully logged out of all sessions.')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(User.query.filter_by(email='joe@gmail.com').first().token_version, 1)
+            self.assertEqual(BlacklistToken.query.count(), 0)
+            for login in logins:
+                response = self.client.get(
+                    '/auth/status',
+                    headers = dict(Authorization='Bearer ' + login['auth_token'])
+                )
+                data = json.loads(response.data.decode())
+                self.assertTrue(data['message'] == 'Token revoked. Please log in again.')
+                self.assertEqual(response.status_code, 401)
+            response = self.client.post(
+                '/auth/refresh',
+                data = json.dumps(dict(refresh_token = logins[1]['refresh_token'])),
+                content_type = 'application/json'
+            )
+            self.assertEqual(response.status_code, 401)
+            # tokens issued afterwards carry the new version
+            response = self.client.post(
+                '/auth/login',
+                data = json.dumps(dict(email = 'joe@gmail.com', password = '123456')),
+                content_type = 'application/json'
+            )
+            response = self.client.get(
+                '/auth/status',
+                headers = dict(Authorization='Bearer ' + json.loads(response.data.decode())['auth_token'])
+            )
+            self.assertEqual(response.status_code, 200)
+
     # Test for user status with malformed bearer token
     def test_user_status_malformed_bearer_token(self):
 
@@ -260,5 +829,18 @@ class TestAuthBlueprint(BaseTestCase):
             self.assertTrue(data['message'] == 'Bearer token malformed.')
             self.assertEqual(response.status_code, 401)
 
+    # Test for logout with malformed bearer token
+    def test_logout_malformed_bearer_token(self):
+        with self.client:
+            resp_register = register_user(self, 'joe@gmail.com', '123456')
+            response = self.client.post(
+                '/auth/logout',
+                headers = dict(Authorization='Bearer' + json.loads(resp_register.data.decode())['auth_token'])
+            )
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'fail')
+            self.assertTrue(data['message'] == 'Bearer token malformed.')
+            self.assertEqual(response.status_code, 401)
+
 if __name__ == '__main__':
     unittest.main()
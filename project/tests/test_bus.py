@@ -0,0 +1,101 @@
+# project/tests/test_bus.py
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from project.server import db
+from project.server.bus import InvalidationBus, bus
+from project.server.models import User, blacklist_cache
+from project.tests.base import BaseTestCase
+
+
+# Waits for a condition set by the bus listener thread
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+# Unit tests for the cross-worker invalidation bus
+class TestInvalidationBus(unittest.TestCase):
+
+    def setUp(self):
+        self.socket_dir = tempfile.mkdtemp()
+        self.sender = InvalidationBus(self.socket_dir, name='sender')
+        self.receiver = InvalidationBus(self.socket_dir, name='receiver')
+        self.sender.start()
+        self.receiver.start()
+
+    def tearDown(self):
+        self.sender.stop()
+        self.receiver.stop()
+        shutil.rmtree(self.socket_dir)
+
+    # Tests that events reach the other workers but not the publisher itself
+    def test_publish_reaches_peers(self):
+        received = {'sender': [], 'receiver': []}
+        self.sender.subscribe('revoked', received['sender'].append)
+        self.receiver.subscribe('revoked', received['receiver'].append)
+        self.sender.publish('revoked', key='abc', exp=1)
+        self.assertTrue(wait_for(lambda: received['receiver']))
+        self.assertEqual(received['receiver'], [{'event': 'revoked', 'key': 'abc', 'exp': 1}])
+        self.assertEqual(received['sender'], [])
+
+    # Tests that the socket of a worker that exited is removed on the next publish
+    def test_stale_socket_removed(self):
+        stale = os.path.join(self.socket_dir, 'stale.sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(stale)
+        sock.close()
+        self.sender.publish('revoked', key='abc')
+        self.assertFalse(os.path.exists(stale))
+
+
+# Tests that invalidations from another worker are applied to this process's caches
+class TestBusInvalidation(BaseTestCase):
+
+    def setUp(self):
+        super(TestBusInvalidation, self).setUp()
+        self.socket_dir = tempfile.mkdtemp()
+        self.settings = (bus.socket_dir, bus.enabled)
+        bus.socket_dir, bus.enabled = self.socket_dir, True
+        bus.start()
+        self.peer = InvalidationBus(self.socket_dir, name='peer')
+
+    def tearDown(self):
+        bus.stop()
+        bus.socket_dir, bus.enabled = self.settings
+        shutil.rmtree(self.socket_dir)
+        super(TestBusInvalidation, self).tearDown()
+
+    # Tests that a logout in another worker is seen without a database lookup
+    def test_remote_revocation(self):
+        self.peer.publish('revoked', key='abc', exp=time.time() + 60)
+        self.assertTrue(wait_for(lambda: blacklist_cache.get('abc', count=False)))
+
+    # Tests that a user update is broadcast once it is committed
+    def test_user_update_published(self):
+        received = []
+        self.peer.start()
+        self.peer.subscribe('user_changed', received.append)
+        try:
+            user = User(email = 'test@test.com', password = 'test')
+            db.session.add(user)
+            db.session.commit()
+            user.admin = True
+            db.session.commit()
+            self.assertTrue(wait_for(lambda: received))
+            self.assertEqual(received[0]['id'], user.id)
+            self.assertTrue(received[0]['identity_changed_at'])
+        finally:
+            self.peer.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# project/tests/test_cache.py
+import threading
+import time
+import unittest
+
+from project.server.bloom import BloomFilter
+from project.server.cache import TTLCache
+from project.server.hashing import HashingPool
+from project.server.ratelimit import MemoryBackend
+
+
+# Unit tests for the in-process TTL cache
+class TestTTLCache(unittest.TestCase):
+
+    # Tests that hits and misses are counted
+    def test_hit_and_miss_counters(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', True)
+        self.assertTrue(cache.get('a'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    # Tests that the least recently used entry is evicted first
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(len(cache), 2)
+
+    # Tests that a per-entry ttl shortens the lifetime of the entry
+    def test_entry_expiry(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1, ttl=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        cache.set('b', 2, ttl=-1)
+        self.assertFalse('b' in cache)
+
+
+# Unit tests for the bounded hashing pool
+class TestHashingPool(unittest.TestCase):
+
+    # Tests that a task submitted before configure() does not release the new semaphore
+    def test_configure_while_running(self):
+        pool = HashingPool(workers=1, queue_depth=0)
+        started = threading.Event()
+        finish = threading.Event()
+        future = pool.submit(lambda: started.set() or finish.wait(5))
+        self.assertTrue(started.wait(5))
+        pool.configure(workers=1, queue_depth=1)
+        # fill the new pool, then let the old task finish
+        self.assertTrue(pool._slots.acquire(False))
+        self.assertTrue(pool._slots.acquire(False))
+        finish.set()
+        future.result(5)
+        self.assertFalse(pool._slots.acquire(False))
+        pool.shutdown()
+
+
+# Unit tests for the revoked-token bloom filter
+class TestBloomFilter(unittest.TestCase):
+
+    # Tests that added items are always reported as present
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add('token-{}'.format(i))
+        for i in range(1000):
+            self.assertTrue('token-{}'.format(i) in bloom)
+
+    # Tests that the false-positive rate stays near the configured rate
+    def test_false_positive_rate(self):
+        bloom = BloomFilter.from_items(
+            ('token-{}'.format(i) for i in range(1000)), capacity=1000, error_rate=0.01)
+        false_positives = sum(1 for i in range(10000) if 'other-{}'.format(i) in bloom)
+        self.assertLess(false_positives, 300)
+
+
+# Unit tests for the sliding-window rate limiter backend
+class TestMemoryBackend(unittest.TestCase):
+
+    # Tests that hits beyond the limit are refused until the window slides
+    def test_sliding_window(self):
+        backend = MemoryBackend()
+        for _ in range(3):
+            self.assertEqual(backend.hit('k', 3, 60, now = 60), 0)
+        self.assertEqual(backend.hit('k', 3, 60, now = 90), 30)
+        # half of the previous window still counts: 3 * 0.5 = 1.5 < 3
+        self.assertEqual(backend.hit('k', 3, 60, now = 150), 0)
+        self.assertEqual(backend.hit('k', 3, 60, now = 180), 0)
+
+    # Tests that memory stays bounded by evicting the least recently used keys
+    def test_eviction(self):
+        backend = MemoryBackend(max_keys = 2)
+        for key in ('a', 'b', 'c'):
+            backend.hit(key, 1, 60, now = 0)
+        self.assertEqual(len(backend), 2)
+        self.assertEqual(backend.hit('a', 1, 60, now = 1), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# project/tests/test_revocation.py
+import time
+import unittest
+
+from project.server import revocation
+from project.server.models import User, BlacklistToken
+from project.tests.base import BaseTestCase, without_transaction
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+# Shared checks every revocation store must pass
+class StoreContract:
+
+    def test_add_and_contains(self):
+        self.store.add('a', time.time() + 60)
+        self.assertTrue(self.store.contains('a'))
+        self.assertFalse(self.store.contains('b'))
+
+    def test_contains_many(self):
+        self.store.add('a', time.time() + 60)
+        self.store.add('c', time.time() + 60)
+        self.assertEqual(self.store.contains_many(['a', 'b', 'c']), set(['a', 'c']))
+
+
+# Unit tests for the in-process revocation store
+class TestMemoryStore(StoreContract, unittest.TestCase):
+
+    def setUp(self):
+        self.store = revocation.MemoryStore()
+
+    # Tests that expired keys are no longer revoked and are pruned
+    def test_expired_keys(self):
+        self.store.add('old', time.time() - 1)
+        self.assertFalse(self.store.contains('old'))
+        self.assertEqual(self.store.prune(), 1)
+
+
+# Runs the Redis store against an in-process fake server
+@unittest.skipUnless(fakeredis, 'fakeredis is not installed')
+class TestRedisStore(StoreContract, unittest.TestCase):
+
+    def setUp(self):
+        self.store = revocation.RedisStore(fakeredis.FakeStrictRedis())
+
+    # Tests that revocations expire with their token instead of being pruned
+    def test_native_expiry(self):
+        self.store.add('a', time.time() + 60)
+        ttl = self.store.client.ttl('revoked:a')
+        self.assertTrue(0 < ttl <= 61)
+        self.store.add('old', time.time() - 1)
+        self.assertFalse(self.store.contains('old'))
+
+
+# Tests the SQL store and the store used by logout
+class TestRevocationStores(StoreContract, BaseTestCase):
+
+    def setUp(self):
+        super(TestRevocationStores, self).setUp()
+        self.store = revocation.SQLStore()
+
+    # Tests that a revoked token is checked through the configured store only
+    def test_revoke_with_memory_store(self):
+        store = revocation.store
+        revocation.store = revocation.MemoryStore()
+        try:
+            user = User(email = 'test@test.com', password = 'test')
+            auth_token = user.encode_auth_token(1)
+            self.assertFalse(BlacklistToken.check_blacklist(auth_token))
+            BlacklistToken.revoke(auth_token)
+            self.assertTrue(BlacklistToken.check_blacklist(auth_token))
+            self.assertTrue(revocation.store.contains(BlacklistToken.token_key(
+                auth_token, BlacklistToken.read_payload(auth_token))))
+            self.assertEqual(BlacklistToken.query.count(), 0)
+        finally:
+            revocation.store = store
+
+    # Tests that queued revocations apply at once and are written in one batch
+    @without_transaction
+    def test_write_behind_flush(self):
+        store = revocation.SQLStore(revocation.RevocationWriter(self.app, flush_size=100, interval=60))
+        for key in ('a', 'b', 'c'):
+            store.add(key, time.time() + 60)
+        store.add('a', time.time() + 60)
+        self.assertEqual(store.contains_many(['a', 'b', 'd']), set(['a', 'b']))
+        self.assertEqual(BlacklistToken.query.count(), 0)
+        self.assertEqual(store.writer.flush(), 3)
+        self.assertEqual(BlacklistToken.query.count(), 3)
+        self.assertTrue(store.contains('c'))
+        self.assertEqual(store.writer.flush(), 0)
+
+    # Tests that a full queue is flushed by the writer thread without waiting
+    @without_transaction
+    def test_write_behind_flush_size(self):
+        store = revocation.SQLStore(revocation.RevocationWriter(self.app, flush_size=2, interval=60))
+        store.add('a', time.time() + 60)
+        store.add('b', time.time() + 60)
+        deadline = time.time() + 5
+        while BlacklistToken.query.count() < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(BlacklistToken.query.count(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# project/tests/test_signing.py
+import datetime
+import unittest
+
+import jwt
+
+from project.server.signing import HS256Engine
+
+SECRET = 'my_precious'
+
+
+def make_payload(**claims):
+    now = datetime.datetime.utcnow()
+    payload = {'exp': now + datetime.timedelta(minutes=5), 'iat': now, 'sub': 1, 'jti': 'abc', 'ver': 0}
+    payload.update(claims)
+    return payload
+
+
+# PyJWT 1.x returns bytes, 2.x str
+def text(token):
+    return token.decode() if isinstance(token, bytes) else token
+
+
+# Unit tests for the fast-path HS256 token engine
+class TestHS256Engine(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = HS256Engine(SECRET)
+
+    # Tests that tokens are byte-for-byte identical to PyJWT's and readable by it
+    def test_matches_pyjwt(self):
+        payload = make_payload()
+        token = self.engine.encode(payload)
+        self.assertEqual(token, jwt.encode(dict(payload), SECRET, algorithm='HS256'))
+        self.assertEqual(jwt.decode(token, SECRET, algorithms=['HS256'])['sub'], 1)
+        self.assertEqual(self.engine.decode(token), jwt.decode(token, SECRET, algorithms=['HS256']))
+
+    # Tests that expired, tampered and foreign-key tokens are rejected
+    def test_rejects_invalid_tokens(self):
+        expired = self.engine.encode(make_payload(exp=datetime.datetime.utcnow() - datetime.timedelta(seconds=5)))
+        with self.assertRaises(jwt.ExpiredSignatureError):
+            self.engine.decode(expired)
+        header, _, signature = text(self.engine.encode(make_payload())).split('.')
+        forged_body = text(self.engine.encode(make_payload(sub=2))).split('.')[1]
+        with self.assertRaises(jwt.InvalidSignatureError):
+            self.engine.decode('.'.join([header, forged_body, signature]))
+        with self.assertRaises(jwt.InvalidSignatureError):
+            self.engine.decode(HS256Engine('another secret').encode(make_payload()))
+        with self.assertRaises(jwt.DecodeError):
+            self.engine.decode('not-a-token')
+
+    # Tests that tokens outside the fast path are validated by PyJWT
+    def test_falls_back_to_pyjwt(self):
+        with self.assertRaises(jwt.InvalidAudienceError):
+            self.engine.decode(self.engine.encode(make_payload(aud='other-service')))
+        token = jwt.encode(make_payload(), SECRET, algorithm='HS256', headers={'kid': 'one'})
+        self.assertEqual(self.engine.decode(token)['sub'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
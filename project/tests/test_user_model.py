@@ -1,9 +1,16 @@
 # project/tests/test_user_model.py
+import calendar
+import datetime
+import threading
+import time
 import unittest
 
-from project.server import db
-from project.server.models import User
-from project.tests.base import BaseTestCase
+from project.server import db, hashing
+from project.server.models import (
+    User, UserRecord, BlacklistToken, _rebuild_lock, add_to_bloom, blacklist_bloom, token_cache, token_versions,
+    user_records
+)
+from project.tests.base import BaseTestCase, without_transaction
 
 # Unit test for the user model
 class TestUserModel(BaseTestCase):
@@ -26,5 +33,163 @@ class TestUserModel(BaseTestCase):
         # Convert bytes into a string
         self.assertTrue(User.decode_auth_token(auth_token.decode("utf-8")) == 1)    
 
+    # Tests that a verified token is served from the decode cache on the next request
+    def test_decode_auth_token_cached(self):
+        user = User(email = 'test@test.com', password = 'test')
+        db.session.add(user)
+        db.session.commit()
+        auth_token = user.encode_auth_token(user.id).decode("utf-8")
+        self.assertTrue(User.decode_auth_token(auth_token) == 1)
+        hits = token_cache.hits
+        self.assertTrue(User.decode_auth_token(auth_token) == 1)
+        self.assertEqual(token_cache.hits, hits + 1)
+        User.evict_auth_token(auth_token)
+        self.assertEqual(len(token_cache), 0)
+
+    # Tests that a token newer than a stale cached version is checked against the table
+    def test_token_version_cache_stale(self):
+        user = User(email = 'test@test.com', password = 'test')
+        db.session.add(user)
+        db.session.commit()
+        old_token = user.encode_auth_token(user.id).decode("utf-8")
+        token_versions.set(user.id, 0)
+        # revoked on another worker, whose change never reached this cache
+        User.query.filter_by(id = user.id).update({'token_version': 1}, synchronize_session = False)
+        db.session.commit()
+        db.session.refresh(user)
+        new_token = user.encode_auth_token(user.id).decode("utf-8")
+        self.assertEqual(User.decode_auth_token(new_token), user.id)
+        self.assertEqual(token_versions.get(user.id), 1)
+        self.assertEqual(User.decode_auth_token(old_token), 'Token revoked. Please log in again.')
+
+    # Tests that a hash made with another cost is upgraded in the background
+    @without_transaction
+    def test_rehash_password_later(self):
+        user = User(email = 'test@test.com', password = 'test')
+        user.password = hashing.generate_password_hash('test', 5)
+        db.session.add(user)
+        db.session.commit()
+        self.assertTrue(hashing.needs_rehash(user.password))
+        user.rehash_password_later('test').result()
+        db.session.expire_all()
+        user = User.query.filter_by(email = 'test@test.com').first()
+        self.assertEqual(hashing.hash_cost(user.password), 4)
+        self.assertTrue(hashing.check_password_hash(user.password, 'test'))
+
+    # Tests that every token carries a unique jti used as its revocation key
+    def test_encode_auth_token_jti(self):
+        user = User(email = 'test@test.com', password = 'test')
+        db.session.add(user)
+        db.session.commit()
+        first = BlacklistToken.read_payload(user.encode_auth_token(user.id))
+        second = BlacklistToken.read_payload(user.encode_auth_token(user.id))
+        self.assertTrue(first['jti'])
+        self.assertNotEqual(first['jti'], second['jti'])
+
+    # Tests that a revocation is stored under the jti with the token's expiry
+    def test_blacklist_token_keyed_by_jti(self):
+        user = User(email = 'test@test.com', password = 'test')
+        db.session.add(user)
+        db.session.commit()
+        auth_token = user.encode_auth_token(user.id)
+        payload = BlacklistToken.read_payload(auth_token)
+        blacklist_token = BlacklistToken(token = auth_token)
+        db.session.add(blacklist_token)
+        db.session.commit()
+        self.assertEqual(blacklist_token.jti, payload['jti'])
+        self.assertEqual(calendar.timegm(blacklist_token.expires_at.utctimetuple()), payload['exp'])
+        self.assertTrue(BlacklistToken.check_blacklist(auth_token))
+
+    # Tests that pruning removes only expired revocations, across several batches
+    def test_prune_expired_blacklist_tokens(self):
+        now = datetime.datetime.utcnow()
+        for i in range(5):
+            db.session.add(BlacklistToken(token = 'expired-{}'.format(i), payload = {'exp': 0}))
+        fresh = BlacklistToken(token = 'fresh', payload = {'exp': int(time.time()) + 60})
+        db.session.add(fresh)
+        db.session.commit()
+        self.assertEqual(BlacklistToken.prune_expired(batch_size = 2, now = now), 5)
+        self.assertEqual(BlacklistToken.query.count(), 1)
+        self.assertEqual(BlacklistToken.query.first().jti, fresh.jti)
+
+    # Tests that rehashes are queued once per user and dropped when the queue is full
+    @without_transaction
+    def test_rehash_password_later_bounded(self):
+        self.app.config['BACKGROUND_QUEUE_SIZE'] = 2
+        users = [User(email = 'test{}@test.com'.format(i), password = 'test') for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        finish = threading.Event()
+        blocker = hashing.background.submit(finish.wait, 5)
+        try:
+            first = users[0].rehash_password_later('test')
+            second = users[1].rehash_password_later('test')
+            self.assertIsNotNone(first)
+            self.assertIsNotNone(second)
+            self.assertIsNone(users[0].rehash_password_later('test'))
+            self.assertIsNone(users[2].rehash_password_later('test'))
+        finally:
+            finish.set()
+        blocker.result()
+        first.result()
+        second.result()
+        users[0].rehash_password_later('test').result()
+
+    # Tests that a stale bloom filter is served while another thread rebuilds it
+    def test_bloom_served_during_rebuild(self):
+        db.session.add(BlacklistToken(token = 'old', payload = {'exp': int(time.time()) + 60}))
+        db.session.commit()
+        key = BlacklistToken.query.first().jti
+        self.assertTrue(BlacklistToken.might_be_blacklisted(key))
+        bloom = blacklist_bloom['filter']
+        blacklist_bloom['built_at'] -= self.app.config['BLACKLIST_BLOOM_REFRESH'] + 1
+        with _rebuild_lock:
+            self.assertTrue(BlacklistToken.might_be_blacklisted(key))
+            self.assertIs(blacklist_bloom['filter'], bloom)
+        self.assertTrue(BlacklistToken.might_be_blacklisted(key))
+        self.assertIsNot(blacklist_bloom['filter'], bloom)
+        self.assertIs(BlacklistToken.rebuild_bloom(max_age = 60), blacklist_bloom['filter'])
+
+    # Tests that keys inserted while the table is scanned reach the new filter
+    def test_bloom_keeps_keys_added_during_rebuild(self):
+        query = db.session.query
+        def scan(*args):
+            add_to_bloom('late')
+            return query(*args)
+        db.session.query = scan
+        try:
+            bloom = BlacklistToken.rebuild_bloom()
+        finally:
+            del db.session.query
+        self.assertTrue('late' in bloom)
+        self.assertIsNone(blacklist_bloom['pending'])
+
+    # Tests that user records are cached read-only snapshots
+    def test_load_record_cached(self):
+        user = User(email = 'test@test.com', password = 'test')
+        db.session.add(user)
+        db.session.commit()
+        record = User.load_record(user.id)
+        self.assertTrue(isinstance(record, UserRecord))
+        self.assertEqual((record.id, record.email, record.admin), (user.id, 'test@test.com', False))
+        hits = user_records.hits
+        self.assertTrue(User.load_record(user.id) is record)
+        self.assertEqual(user_records.hits, hits + 1)
+        with self.assertRaises(AttributeError):
+            record.admin = True
+        self.assertIsNone(User.load_record(user.id + 1))
+
+    # Tests that committing a change to a user drops its cached record
+    def test_load_record_invalidated_on_commit(self):
+        user = User(email = 'test@test.com', password = 'test')
+        db.session.add(user)
+        db.session.commit()
+        User.load_record(user.id)
+        user.admin = True
+        db.session.flush()
+        self.assertFalse(User.load_record(user.id).admin)
+        db.session.commit()
+        self.assertTrue(User.load_record(user.id).admin)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file